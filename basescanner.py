@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+from abc import ABC, abstractmethod
+
+#what the github, gitlab and local scanners share: handing on each finished repo (or project) result, and retrying the
+#lookups that failed at the end of the scan
+#subclasses say how to get at a result's files (get_result_files) and what it is streamed as (get_result_record)
+class BaseScanner(ABC):
+
+    def __init__(self):
+        #streamed results with failed lookups, held back until those are retried at the end of the scan
+        self.deferred = []
+
+    #gets (path, file result) pairs for a result
+    @abstractmethod
+    def get_result_files(self, result):
+        pass
+
+    #gets the record a result is streamed as
+    @abstractmethod
+    def get_result_record(self, result):
+        pass
+
+    #journals a finished result as key/res (if it scanned cleanly), then streams it to the writer, or hands it to collect
+    def add_result(self, result, res, key, writer=None, checkpoint=None, collect=None):
+        unresolved = any('unresolved' in file for path, file in self.get_result_files(result))
+        if checkpoint and 'errors' not in res and not unresolved:
+            checkpoint.add(key, res)
+        if writer and unresolved:
+            self.deferred.append(result)
+        elif writer:
+            writer.write(self.get_result_record(result))
+        else:
+            collect(result)
+
+    #retries the lookups that failed during the scan (in results, or the held back results when streaming),
+    #then writes out any streamed results that were held back for them
+    def retry_results(self, results, writer=None):
+        if writer:
+            results, self.deferred = self.deferred, []
+        self.FILESCANNER.retry_unresolved([file for result in results for file in self.get_result_files(result)])
+        if writer:
+            for result in results:
+                writer.write(self.get_result_record(result))
+
+    #gets (path, file result) pairs for a repo result ({name: [files], 'errors': [...]})
+    @staticmethod
+    def get_repo_files(res):
+        return [(next(iter(file)), file[next(iter(file))]) for file in res[next(iter(res))]]
+
+    #flattens a repo result into a single streamed record
+    @staticmethod
+    def get_repo_record(res, org=None):
+        rname = next(iter(res))
+        record = {'org': org} if org is not None else {}
+        record.update({'repo': rname, 'files': res[rname]})
+        if 'errors' in res:
+            record['errors'] = res['errors']
+        return record
+
+    #gets (vulnerable, sus) counts for a streamed repo record
+    @staticmethod
+    def get_repo_counts(record):
+        v = 0
+        s = 0
+        for file in record['files']:
+            fname = next(iter(file))
+            v += len(file[fname]['vulnerable'])
+            s += len(file[fname]['sus'])
+        return (v, s)
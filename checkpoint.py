@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import json
+import threading
+
+#append-only journal of finished work (one NDJSON line per finished repo/project)
+#so a crashed or rate limited scan can be resumed without redoing what was already scanned
+#keys look like 'repo/<org>/<repo>', 'project/<id>' or 'path/<local repo>'
+class Checkpoint:
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        #only results from a previous run are kept in memory, new ones just go to disk
+        self.results = {}
+        #keys grouped by everything up to their last '/', so finding an org's repos doesnt scan the whole journal
+        self.groups = {}
+        if resume and os.path.isfile(path):
+            self.load()
+            print(f"Resuming from {path} ({len(self.results)} finished items)")
+        self.file = open(path, "a" if resume else "w")
+        #make sure we dont append onto a half written line
+        if resume and self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    #reads a previous journal (a half written last line from a crash is skipped)
+    def load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record['key'] not in self.results:
+                        self.groups.setdefault(record['key'].rsplit('/', 1)[0] + '/', []).append(record['key'])
+                    self.results[record['key']] = record['result']
+                except Exception:
+                    continue
+
+    #records a finished item
+    def add(self, key, result):
+        line = json.dumps({'key': key, 'result': result})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    #returns the result of an item finished in a previous run (or None)
+    def get(self, key):
+        return self.results.get(key)
+
+    #returns (key, result) for every previously finished item directly under prefix (e.g. 'repo/<org>/')
+    def find(self, prefix):
+        return [(key, self.results[key]) for key in self.groups.get(prefix, [])]
+
+    #closes the journal, removing it once the final report has been written (so the next run starts fresh)
+    def close(self, remove=True):
+        with self.lock:
+            self.file.close()
+        if remove and os.path.isfile(self.path):
+            os.remove(self.path)
@@ -7,17 +7,60 @@
 import json
 import os
 import sys
+import posixpath
+import re
+import fnmatch
 import importlib
+import threading
+import multiprocessing
 import concurrent.futures
-from memoization import cached
+from resolver import Resolver
+from lookupcache import LookupCache, NOT_FOUND, ERROR
 import dac_constants
 
+#manifest parsing pool for this process (pid, pool), see get_parse_pool
+PARSE_POOL = None
+PARSE_POOL_LOCK = threading.Lock()
+#how many processes of this run are scanning (and so each starting a parsing pool), see set_scan_procs
+SCAN_PROCS = 1
+
+#called in each worker of a multi process scan, with how many workers there are
+def set_scan_procs(procs):
+    global SCAN_PROCS
+    SCAN_PROCS = max(procs, 1)
+
+#how many processes this process's parsing pool gets: DAC_PARSE_PROCS if it is set, otherwise the cores split between
+#the scanning processes (so --procs 8 on 8 cores doesnt start 64 of them), 0 once each scanning process has a core or less
+def get_parse_procs():
+    if dac_constants.PARSE_PROCS is not None:
+        return dac_constants.PARSE_PROCS
+    return (os.cpu_count() or 1) // SCAN_PROCS
+
+#gets this process's parsing pool, or None if manifests should be parsed inline
+#(turned off, or we are already a daemonic pool worker, which cant start processes of its own)
+def get_parse_pool():
+    global PARSE_POOL
+    if get_parse_procs() <= 0 or multiprocessing.current_process().daemon:
+        return None
+    if PARSE_POOL is None or PARSE_POOL[0] != os.getpid():
+        with PARSE_POOL_LOCK:
+            if PARSE_POOL is None or PARSE_POOL[0] != os.getpid():
+                #spawned rather than forked, forking a process with hundreds of busy threads can copy their held locks
+                PARSE_POOL = (os.getpid(), concurrent.futures.ProcessPoolExecutor(get_parse_procs(), multiprocessing.get_context('spawn')))
+    return PARSE_POOL[1]
+
+#runs a module's parse func in a parsing pool process (modules are imported there by name, funcs cant be pickled)
+def parse_manifest(lib_path, module_name, func_name, filename, data):
+    if lib_path not in sys.path:
+        sys.path.append(lib_path)
+    return getattr(importlib.import_module(module_name), func_name)(filename, data)
+
 class Scanner:
     
     def __init__(self, modules_path, modules_file):
         #check modules.json and import our modules
-        LIB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.join(modules_path)))
-        sys.path.append(LIB_PATH)
+        self.LIB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.join(modules_path)))
+        sys.path.append(self.LIB_PATH)
 
         #load modules.json
         with open(os.path.abspath(os.path.join(os.path.dirname(__file__), modules_file))) as f:
@@ -25,14 +68,85 @@ class Scanner:
         for module in self.MODULES['modules']:
             #set d as a ref to the module itself (for calling funcs)
             module['d'] = importlib.import_module(module['name'])
-            #set funcs as refs to funcs from the strings
+            #set funcs as refs to funcs from the strings (keeping the name, for the parsing pool)
+            module['parse_func_name'] = module['parse_func']
             module['parse_func'] = getattr(module['d'], module['parse_func'])
             module['repo_check_func'] = getattr(module['d'], module['repo_check_func'])
+            #registry is used to key the persistent lookup cache (modules without one arent cached)
+            module['registry'] = module.get('registry')
+            #package fields that the repo check actually looks at
+            module['cache_key'] = tuple(module.get('cache_key', ['name']))
+            #package field that marks a lockfile entry, answered from the lockfile itself rather than the registry
+            module['locked_field'] = module.get('locked_field')
             module['manifest_file'] = [x.lower() for x in module['manifest_file']]
             module['lock_file'] = [x.lower() for x in module['lock_file']]
             if 'config_file' in module:
                 module['config_file'] = module['config_file'].lower()
                 module['config_parse_func'] = getattr(module['d'], module['config_parse_func'])
+        #every manifest scanned by this scanner shares one resolution stage
+        self.RESOLVER = Resolver()
+        #lowercased file name -> (module, role), so every file is dispatched with one dict lookup
+        #names with wildcards (e.g. *.csproj) go into a single combined regex, only tried when the dict misses
+        self.FILE_LOOKUP = {}
+        self.FILE_GLOBS = []
+        for module in self.MODULES['modules']:
+            files = [(x, 'manifest') for x in module['manifest_file']] + [(x, 'lock') for x in module['lock_file']]
+            if 'config_file' in module:
+                files.append((module['config_file'], 'config'))
+            for file, role in files:
+                if any(x in file for x in ('*', '?', '[')):
+                    self.FILE_GLOBS.append((file, module, role))
+                else:
+                    self.FILE_LOOKUP[file] = (module, role)
+        self.FILE_GLOB_REGEX = None
+        if self.FILE_GLOBS:
+            self.FILE_GLOB_REGEX = re.compile('|'.join(f"(?P<g{i}>{fnmatch.translate(x[0])})" for i, x in enumerate(self.FILE_GLOBS)))
+
+    #returns (module, role) for a file name or path (role is manifest, lock or config), or None if no module handles it
+    def lookup_file(self, path):
+        name = posixpath.basename(path).lower()
+        match = self.FILE_LOOKUP.get(name)
+        if match is None and self.FILE_GLOB_REGEX is not None:
+            res = self.FILE_GLOB_REGEX.match(name)
+            if res:
+                match = self.FILE_GLOBS[int(res.lastgroup[1:])][1:]
+        return match
+
+    #picks the manifest files out of a (recursive) repo tree and works out which ones are overridden
+    #entries need a 'path', anything else (blob ids, shas) is carried through to the results
+    #get_config is called with the entry for each config file found and returns {'file', 'content'}
+    def find_manifests(self, entries, get_config):
+        files = []
+        overrides = set()
+        configs = []
+        for entry in entries:
+            path = entry['path']
+            match = self.lookup_file(path)
+            if match is None:
+                continue
+            module, role = match
+            name = posixpath.basename(path).lower()
+            directory = posixpath.dirname(path)
+            if role == 'config':
+                #a config pointing at internal registries means this module's files can be skipped in this directory (and below)
+                if module['config_parse_func'](get_config(entry)):
+                    configs.append((module['name'], directory))
+            else:
+                files.append({**entry, 'name': path, 'override': False, 'module': module['name']})
+                #a lock file means the manifests (and lower priority lock files) next to it dont need scanning
+                if role == 'lock':
+                    for file in module['manifest_file'] + module['lock_file'][:-1]:
+                        if not name == file:
+                            overrides.add((directory, file))
+        globoverrides = [x for x in overrides if any(c in x[1] for c in ('*', '?', '['))]
+        for f in files:
+            directory = posixpath.dirname(f['name'])
+            name = posixpath.basename(f['name']).lower()
+            if (directory, name) in overrides or any(d == directory and fnmatch.fnmatch(name, x) for d, x in globoverrides):
+                f['override'] = True
+            elif any(m == f['module'] and (d == "" or directory == d or directory.startswith(d + "/")) for m, d in configs):
+                f['override'] = True
+        return files
 
     # creates nested object output for a single manifest file
     @staticmethod
@@ -41,21 +155,67 @@ class Scanner:
             result = {file: {'vulnerable': [], 'sus': [], 'override': True}}
         else:
             result = {file: {'vulnerable': res['vulnerable'], 'sus': res['sus']}}
+            #names whose lookups failed (even after retrying) are neither safe nor vulnerable yet
+            if res.get('unresolved'):
+                result[file]['unresolved'] = res['unresolved']
         return result
 
+    #builds the context a repo's manifests are parsed with: for each module with repo_context set in modules.json,
+    #the repo's files for that module by path (files are {'file', 'content', 'override'}, as for scan_contents)
+    #so the module can read the others while parsing one of them (e.g. a pom inherits from its parent pom and boms)
+    def get_repo_context(self, files):
+        context = {}
+        for file in files:
+            match = self.lookup_file(file['file'])
+            if match is not None and match[0].get('repo_context') and match[1] != 'config' and not file['override']:
+                context.setdefault(match[0]['name'], {'files': {}, 'lock': threading.RLock()})['files'][file['file']] = file['content']
+        return context
+
+    #in incremental mode, splits a repo's manifests (from find_manifests) into the ones whose last result (in state) can be
+    #reused and the ones to scan, sha names the field holding each file's blob sha
+    #returns (reused manifests, as {'path', 'sha', 'override', 'result', 'checked'}, files to scan)
+    def split_manifests(self, state, repo, files, sha='sha'):
+        if state is None:
+            return [], files
+        manifests = state.get_manifests(repo)
+        rows = {file['name']: state.get_manifest(manifests, file['name'], file[sha], file['override']) for file in files}
+        stale = self.get_stale_modules(files, rows)
+        reused = []
+        todo = []
+        for file in files:
+            row = rows[file['name']] if file['module'] not in stale else None
+            if row is not None:
+                reused.append({**row, 'path': file['name']})
+            else:
+                todo.append(file)
+        return reused, todo
+
+    #in incremental mode, the modules with repo_context set that have a file (from find_manifests) still to scan
+    #rows holds each file's reusable result from the last scan (or None), if one of those files changed,
+    #all of the repo's files for the module are scanned again (a changed parent pom changes its unchanged modules)
+    def get_stale_modules(self, files, rows):
+        stale = set()
+        for file in files:
+            match = self.lookup_file(file['name'])
+            if rows[file['name']] is None and match is not None and match[0].get('repo_context'):
+                stale.add(file['module'])
+        return stale
+
     #checks a data string for dependency confusion
-    def scan_contents(self, name, data, override=False):
+    #context is the repo's context (see get_repo_context) when the file is scanned as part of a repo
+    def scan_contents(self, name, data, override=False, context=None):
         errstr = ""
         try:
             singleresult = {}
             res = []
             if not override:
                 #check file to see if we have a module for it
-                for module in self.MODULES['modules']:
-                    if name.lower() in module['manifest_file'] or name.lower() in module['lock_file']:
-                        errstr = f"{module['parse_func'].__name__}({name}, data)"
-                        res = self.check_dependencies(module['parse_func'](name, data), module['repo_check_func'])
-                        break            
+                #name can be a path inside a repo, modules are picked by the file name
+                match = self.lookup_file(name)
+                if match is not None and match[1] != 'config':
+                    module = match[0]
+                    errstr = f"{module['parse_func'].__name__}({name}, data)"
+                    res = self.check_dependencies(self.parse(module, posixpath.basename(name), data, context.get(module['name']) if context else None), module['repo_check_func'], module['registry'], module['cache_key'], module['locked_field'])
 
             #creates the output object for this result and append it to
             #the overall output if there was an actual vuln or sus
@@ -65,38 +225,50 @@ class Scanner:
             singleresult['errors'] = errstr
         return singleresult
 
-    #check each dependency (now with threads!)
-    def check_dependencies(self, deps, repo_check_method):
+    #parses a manifest into its dependencies
+    #big manifests go to the parsing pool, so parsing scales with cores instead of sharing the GIL with the network threads
+    #(small ones arent worth the trip, and are parsed right here, as are modules with repo_context set in modules.json,
+    #whose parse func also gets the repo's context)
+    def parse(self, module, filename, data, context=None):
+        if module.get('repo_context'):
+            return module['parse_func'](filename, data, context)
+        pool = get_parse_pool() if len(data) >= dac_constants.PARSE_INLINE_SIZE else None
+        if pool is not None:
+            try:
+                return pool.submit(parse_manifest, self.LIB_PATH, module['name'], module['parse_func_name'], filename, data).result()
+            except concurrent.futures.process.BrokenProcessPool:
+                #a parsing process died, parse it here instead
+                pass
+        return module['parse_func'](filename, data)
+
+    #check each dependency (through the shared resolver)
+    def check_dependencies(self, deps, repo_check_method, registry=None, cache_key=('name',), locked_field=None):
         try:
             vulnerable = []
             sus = []
             res = []
             safe = []
+            unresolved = []
 
-            #remove dependencies in the ignore list
-            tmpdeps = []
-            for dep in deps:
-                if dep['name'] not in dac_constants.IGNORE_LIST:
-                    tmpdeps.append(dep)
-            deps = tmpdeps
+            #remove dependencies in the ignore list (for this registry)
+            ignore = dac_constants.IGNORE_INDEXES.get(registry, dac_constants.IGNORE_INDEXES['default'])
+            deps = [dep for dep in deps if not ignore.matches(dep['name'])]
             
-            #check each dependency with a new thread
-            with concurrent.futures.ThreadPoolExecutor(max_workers=15) as executor:
-                fut = [executor.submit(repo_check_wrapper, repo_check_method, dep) for dep in deps]
-                for r in concurrent.futures.as_completed(fut):
-                    res.append(r.result())
+            #hand the dependencies to the resolver, which looks each unique one up once
+            res = self.RESOLVER.resolve_all(repo_check_method, deps, registry, cache_key, locked_field)
             res = sorted(res, key = lambda i: i['package']['name'])
             
             for result in res:
-                if result['version'] == '0.0.0.0' or result['version'] == []:
-                    #if it doesnt exist in public repo, its vulnerable
+                kind = self.classify(result['package']['name'], result['version'])
+                if kind == 'vulnerable':
                     vulnerable.append(result['package']['name'])
+                elif kind == 'sus':
+                    sus.append(result['package']['name'])
+                elif kind == 'unresolved':
+                    #keep the full coordinates, so the lookup can be retried at the end of the scan
+                    unresolved.append(LookupCache.get_coords(result['package'], cache_key))
                 else:
-                    if any(substring in result['package']['name'] for substring in dac_constants.PRIVATE_KEYWORDS):
-                        #if its marked as private or seems like ours, but exists in public repo, then its a possible exploit in progress
-                        sus.append(result['package']['name'])
-                    else:
-                        safe.append(result['package']['name'])
+                    safe.append(result['package']['name'])
             
             #get rid of any empties
             safe = list(set(filter(None, safe)))
@@ -108,15 +280,63 @@ class Scanner:
             sus = list(set(filter(None, sus)))
             if len(sus):
                 sus.sort()
-            return {'vulnerable': vulnerable, 'sus': sus, 'safe': safe}
+            unresolved = sorted(set(unresolved))
+            return {'vulnerable': vulnerable, 'sus': sus, 'safe': safe, 'unresolved': unresolved}
             
         except Exception as e:
             if "new thread" not in str(e):
                 print(f"Error: {e} in check_dependencies")
             raise
 
-# need this to cache results
-@cached
-def repo_check_wrapper(repo_check_method, pkg):
-    tmp = repo_check_method(pkg)
-    return {'package': pkg, 'version': tmp}
\ No newline at end of file
+    #sorts a looked up package into vulnerable, sus, safe or unresolved
+    @staticmethod
+    def classify(name, version):
+        if version == ERROR:
+            return 'unresolved'
+        if version == NOT_FOUND or version == []:
+            #if it doesnt exist in public repo, its vulnerable
+            return 'vulnerable'
+        if dac_constants.PRIVATE_MATCHER.matches(name):
+            #if its marked as private or seems like ours, but exists in public repo, then its a possible exploit in progress
+            return 'sus'
+        return 'safe'
+
+    #re-resolves the lookups that failed during a scan (once, at the end of it), updating the file results in place
+    #files is a list of (path, file result) pairs, returns how many names are still unresolved afterwards
+    #this is the end of the scan, so the resolver's worker pools are stopped afterwards (anything submitted later starts new ones)
+    def retry_unresolved(self, files):
+        try:
+            files = [(path, result) for path, result in files if result.get('unresolved')]
+            if not files:
+                return 0
+            print(f"Retrying failed lookups in {len(files)} files...")
+            #each unique name is only retried once, no matter how many files it is in
+            futs = {}
+            for path, result in files:
+                module = self.lookup_file(path)[0]
+                for coords in result['unresolved']:
+                    if (module['repo_check_func'], coords) not in futs:
+                        futs[(module['repo_check_func'], coords)] = self.RESOLVER.submit(module['repo_check_func'], LookupCache.get_package(coords, module['cache_key']), module['registry'], module['cache_key'])
+            left = 0
+            for path, result in files:
+                module = self.lookup_file(path)[0]
+                unresolved = []
+                for coords in result.pop('unresolved'):
+                    name = coords.rsplit(':', 1)[-1]
+                    kind = self.classify(name, futs[(module['repo_check_func'], coords)].result())
+                    if kind == 'unresolved':
+                        unresolved.append(coords)
+                    elif kind != 'safe':
+                        result[kind] = sorted(set(result[kind] + [name]))
+                if unresolved:
+                    result['unresolved'] = unresolved
+                    left += len(unresolved)
+            print(f"Done - {left} names still unresolved")
+            return left
+        finally:
+            self.RESOLVER.shutdown()
+
+    #prints the in-memory lookup cache counters (for the end of a run)
+    def print_cache_stats(self):
+        stats = self.RESOLVER.memory.stats()
+        print(f"Lookup cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions ({stats['size']}/{stats['max_size']} entries)")
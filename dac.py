@@ -8,6 +8,8 @@ import time
 import click
 import urllib3
 from ghscanner import GHScanner
+from resultswriter import ResultsWriter
+from checkpoint import Checkpoint
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
@@ -23,11 +25,13 @@ def dazed_and_confused():
 @click.option("-repo", "-r", required=True, help="repo name")
 @click.option("-resultsfile", "-rf", required=True, help="file for results")
 @click.option('--public', '-p', is_flag=True, help="public GitHub.com")
-def single(org, repo, resultsfile, public):
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def single(org, repo, resultsfile, public, incremental):
     """ The [single] command scans a single github repository """
-    scanner = GHScanner(public=public)
+    scanner = GHScanner(public=public, incremental=incremental)
     starttime = time.time()
     results = {'orgs_scanned': 0, 'repos_scanned': 1, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'orgs': [{org: [scanner.check_single_repo(org, repo)]}]}
+    scanner.finish_unresolved({org: results['orgs'][0]})
                     
     #do recap
     results['time_elapsed'] = time.time() - starttime
@@ -35,6 +39,7 @@ def single(org, repo, resultsfile, public):
     results['vulnerable'] = recap['vulnerable']
     results['sus'] = recap['sus']
     scanner.write_output_file(resultsfile, results)
+    scanner.FILESCANNER.print_cache_stats()
 
 
 @dazed_and_confused.command('all', short_help='scans all repositories in a single org on a public or private github instance')
@@ -42,12 +47,23 @@ def single(org, repo, resultsfile, public):
 @click.option("-resultsfile", "-rf", required=True, help="file for results")
 @click.option('--conc', "-c", default=200, show_default=True, help='Number of concurrent repo scans per org (higher for servers, lower for desktop/laptops)')
 @click.option('--public', '-p', is_flag=True, help="public GitHub.com")
-def all(org, resultsfile, conc, public):
+@click.option('--stream', '-s', is_flag=True, help="stream results to the results file as NDJSON (one line per repo) as they finish")
+@click.option('--resume', is_flag=True, help="resume an interrupted scan from its journal (<resultsfile>.journal), skipping repos it already finished")
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def all(org, resultsfile, conc, public, stream, resume, incremental):
     """ The [all] command scans all github repositories in a single organization """
-    scanner = GHScanner(conc, public=public)
+    scanner = GHScanner(conc, public=public, incremental=incremental)
     starttime = time.time()
+    checkpoint = Checkpoint(resultsfile + ".journal", resume)
+    if stream:
+        writer = ResultsWriter(resultsfile, scanner.get_repo_counts)
+        scanner.scan_org(org, writer, checkpoint)
+        close_stream(writer, 1, starttime)
+        checkpoint.close()
+        scanner.FILESCANNER.print_cache_stats()
+        return
     results = {'orgs_scanned': 1, 'repos_scanned': 0, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'orgs': []}
-    results['orgs'] = [scanner.check_single_org(org)]
+    results['orgs'] = [scanner.scan_org(org, None, checkpoint)]
     
     #do recap
     results['time_elapsed'] = time.time() - starttime
@@ -56,24 +72,42 @@ def all(org, resultsfile, conc, public):
     results['vulnerable'] = recap['vulnerable']
     results['sus'] = recap['sus']
     scanner.write_output_file(resultsfile, results)
+    checkpoint.close()
+    scanner.FILESCANNER.print_cache_stats()
 
 @dazed_and_confused.command('full', short_help='scans orgs on a public or private github instance')
 @click.option("-resultsfile", "-rf", required=True, help="file for results")
-@click.option('--conc', "-c", default=200, show_default=True, help='Number of concurrent repo scans per org (higher for servers, lower for desktop/laptops)')
+@click.option('--conc', "-c", default=200, show_default=True, help='Number of concurrent repo scans per process (higher for servers, lower for desktop/laptops)')
 @click.option('--procs', default=3, show_default=True, help='Number of concurrent processes to use for scanning orgs (roughly, how many cores to use)')
 @click.option('--public', '-p', is_flag=True, help="public GitHub.com")
-def full(resultsfile, conc, procs, public):
+@click.option('--stream', '-s', is_flag=True, help="stream results to the results file as NDJSON (one line per repo) as they finish")
+@click.option('--resume', is_flag=True, help="resume an interrupted scan from its journal (<resultsfile>.journal), skipping repos it already finished")
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def full(resultsfile, conc, procs, public, stream, resume, incremental):
     """ The [full] command scans all available organizations on a github server """
-    scanner = GHScanner(conc, procs, public=public)
+    scanner = GHScanner(conc, procs, public=public, incremental=incremental)
     starttime = time.time()
-    results = scanner.scan_all_orgs()
+    checkpoint = Checkpoint(resultsfile + ".journal", resume)
+    if stream:
+        writer = ResultsWriter(resultsfile, scanner.get_repo_counts)
+        results = scanner.scan_all_orgs(writer, checkpoint)
+        close_stream(writer, results['orgs_scanned'], starttime)
+        checkpoint.close()
+        return
+    results = scanner.scan_all_orgs(None, checkpoint)
 
     #do recap    
     recap = scanner.get_dac_recap(results)
     results['repos_scanned'] = recap['repos_scanned']
     results['vulnerable'] = recap['vulnerable']
     results['sus'] = recap['sus']
-    scanner.write_output_file(resultsfile, results)                
+    scanner.write_output_file(resultsfile, results)
+    checkpoint.close()
+
+#writes the recap line and closes a streamed results file
+def close_stream(writer, orgs_scanned, starttime):
+    recap = {'orgs_scanned': orgs_scanned, 'repos_scanned': writer.totals['scanned'], 'vulnerable': writer.totals['vulnerable'], 'sus': writer.totals['sus'], 'time_elapsed': time.time() - starttime}
+    writer.close(recap)
 
 if __name__ == '__main__':
     dazed_and_confused()
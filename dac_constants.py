@@ -5,6 +5,8 @@
 # For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 #
 import os
+import glob
+from matchers import IgnoreIndex, KeywordMatcher
 
 #loads a line-by-line text file into a list        
 def load_text_to_list(filename):
@@ -21,4 +23,102 @@ def load_text_to_list(filename):
 #keywords
 INTERNAL_KEYWORDS = ['internal'] #list of keywords that indicate a private repository
 PRIVATE_KEYWORDS = load_text_to_list(os.path.join(os.path.dirname(__file__), os.path.abspath("./keywordlists/privatekeywords.txt")))
+#compiled once, use these rather than looping over the keyword lists
+INTERNAL_MATCHER = KeywordMatcher(INTERNAL_KEYWORDS)
+PRIVATE_MATCHER = KeywordMatcher(PRIVATE_KEYWORDS)
 IGNORE_LIST = load_text_to_list(os.path.join(os.path.dirname(__file__), os.path.abspath("./keywordlists/ignore.txt")))    
+
+#loads the ignore indexes, keywordlists/ignore.txt applies everywhere and ignore-<registry>.txt only to that registry
+def load_ignore_indexes():
+    results = {'default': IgnoreIndex(IGNORE_LIST)}
+    for filename in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywordlists", "ignore-*.txt")):
+        registry = os.path.basename(filename)[len("ignore-"):-len(".txt")]
+        results[registry] = IgnoreIndex(IGNORE_LIST + load_text_to_list(filename))
+    return results
+
+IGNORE_INDEXES = load_ignore_indexes()
+
+#resolver worker threads per registry (caps concurrent lookups against each registry)
+RESOLVER_WORKERS = {
+    'default': 15,
+    'npm': 30,
+    'pypi': 20,
+    'maven': 10
+}
+
+#keep-alive connections per registry host (also the most concurrent requests we make to that host)
+REGISTRY_CONNECTIONS = {
+    'default': 10,
+    'registry.npmjs.org': 30,
+    'pypi.org': 20
+}
+
+#in-memory lookup cache (entries per process, seconds an entry is good for)
+MEMORY_CACHE_SIZE = 50000
+MEMORY_CACHE_TTL = 3600
+
+#persistent registry lookup cache (set DAC_CACHE_FILE to an empty string to turn it off)
+CACHE_FILE = os.getenv("DAC_CACHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lookupcache.db"))
+#seconds to keep found/not found answers per registry, not found answers expire quicker since they are the ones that get reported
+CACHE_TTLS = {
+    'default': {'found': 7 * 86400, 'not_found': 6 * 3600},
+    'npm': {'found': 7 * 86400, 'not_found': 6 * 3600},
+    'pypi': {'found': 7 * 86400, 'not_found': 6 * 3600},
+    'rubygems': {'found': 7 * 86400, 'not_found': 6 * 3600},
+    'packagist': {'found': 7 * 86400, 'not_found': 6 * 3600},
+    'maven': {'found': 14 * 86400, 'not_found': 12 * 3600},
+    'cocoapods': {'found': 14 * 86400, 'not_found': 12 * 3600}
+}
+
+#offline registry snapshots (built with dacutil.py snapshot), and how long (seconds) before one is too old to use
+SNAPSHOT_DIR = os.getenv("DAC_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+SNAPSHOT_MAX_AGE = 7 * 86400
+
+#incremental scan state (repo HEAD and manifest blob shas, with their last results), and how long (seconds) a result can be reused before it is rescanned anyway
+STATE_FILE = os.getenv("DAC_STATE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scanstate.db"))
+STATE_MAX_AGE = 7 * 86400
+
+#full scans: how many times an errored repo is put back on the queue, and how often (seconds) to print how much work is left
+REPO_RETRIES = 1
+STATUS_INTERVAL = 30
+
+#github api limiter: calls to leave unspent before the reset, how many calls can go out back to back,
+#seconds to back off on a secondary rate limit without a Retry-After, and how many times a throttled call is retried
+GITHUB_RATE_RESERVE = 500
+GITHUB_BURST = 20
+GITHUB_SECONDARY_WAIT = 60
+GITHUB_RETRIES = 3
+
+#public registry limits: requests per second per host (shared by every process of a scan), how the rate adapts
+#when a registry answers 429/503 (cut by decrease, then climb back by increase per successful call), and retries per throttled call
+REGISTRY_LIMITS = {
+    'default': 20,
+    'registry.npmjs.org': 50,
+    'registry.yarnpkg.com': 50,
+    'pypi.org': 30,
+    'rubygems.org': 10,
+    'repo.packagist.org': 20,
+    'search.maven.org': 10,
+    'wbhhamhynm-dsn.algolia.net': 10
+}
+REGISTRY_AIMD = {'increase': 0.1, 'decrease': 0.5, 'min_rate': 0.5}
+REGISTRY_RETRIES = 3
+
+#failed registry lookups: retries (with a backoff doubling from RESOLVER_BACKOFF seconds) before a name is left unresolved
+RESOLVER_RETRIES = 2
+RESOLVER_BACKOFF = 1
+
+#leave archived repos out of github org scans (empty repos are always left out)
+SKIP_ARCHIVED = True
+
+#manifests fetched per bulk request (github graphql blobs, gitlab graphql blobs)
+MANIFEST_BATCH = 50
+
+#folders skipped when scanning local checkouts (installed dependencies, not our own manifests)
+LOCAL_SKIP_DIRS = ['.git', 'node_modules', 'bower_components']
+
+#processes (per scanning process) that parse manifests, so parsing isnt bound to one core by the GIL (0 parses everything inline)
+#unset, the cores are split between the scanning processes of the run (see contentscanner.get_parse_procs)
+PARSE_PROCS = int(os.environ["DAC_PARSE_PROCS"]) if os.getenv("DAC_PARSE_PROCS") else None
+#manifests smaller than this (characters) are parsed inline, handing them to another process costs more than parsing them
+PARSE_INLINE_SIZE = 16384
@@ -7,6 +7,8 @@
 import time
 import click
 from glscanner import GLScanner
+from resultswriter import ResultsWriter
+from checkpoint import Checkpoint
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -19,13 +21,15 @@ def dazed_and_confused():
 @dazed_and_confused.command('single', short_help='scans a single project in a gitlab instance')
 @click.option("-projectid", "-p", required=True, help="project id")
 @click.option("-resultsfile", "-rf", required=True, help="file for results")
-def single(projectid, resultsfile):
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def single(projectid, resultsfile, incremental):
     """ The [single] command scans a single gitlab project """
-    scanner = GLScanner()
+    scanner = GLScanner(incremental=incremental)
     starttime = time.time()
     results = {'projects_scanned': 1, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'projects': []}
     singleresult = [scanner.check_single_project(projectid)]
     results['projects'] = singleresult
+    scanner.finish_unresolved(results)
                     
     #do recap
     results['time_elapsed'] = time.time() - starttime
@@ -33,16 +37,29 @@ def single(projectid, resultsfile):
     results['vulnerable'] = recap['vulnerable']
     results['sus'] = recap['sus']
     scanner.write_output_file(resultsfile, results)
+    scanner.FILESCANNER.print_cache_stats()
     
 
 @dazed_and_confused.command('full', short_help='scans all projects in a gitlab instance')
 @click.option("-resultsfile", "-rf", required=True, help="file for results")
 @click.option('--conc', "-c", default=200, show_default=True, help='Number of concurrent repo scans per org (higher for servers, lower for desktop/laptops)')
-def full(resultsfile, conc):
+@click.option('--stream', '-s', is_flag=True, help="stream results to the results file as NDJSON (one line per project) as they finish")
+@click.option('--resume', is_flag=True, help="resume an interrupted scan from its journal (<resultsfile>.journal), skipping projects it already finished")
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def full(resultsfile, conc, stream, resume, incremental):
     """ The [full] command scans all available projects on a gitlab server """
-    scanner = GLScanner(conc)
+    scanner = GLScanner(conc, incremental)
     starttime = time.time()
-    results = scanner.scan_all_projects()
+    checkpoint = Checkpoint(resultsfile + ".journal", resume)
+    if stream:
+        writer = ResultsWriter(resultsfile, scanner.get_project_counts)
+        scanner.scan_all_projects(writer, checkpoint)
+        recap = {'projects_scanned': writer.totals['scanned'], 'vulnerable': writer.totals['vulnerable'], 'sus': writer.totals['sus'], 'time_elapsed': time.time() - starttime}
+        writer.close(recap)
+        checkpoint.close()
+        scanner.FILESCANNER.print_cache_stats()
+        return
+    results = scanner.scan_all_projects(None, checkpoint)
     
     #do recap
     results['time_elapsed'] = time.time() - starttime
@@ -50,7 +67,9 @@ def full(resultsfile, conc):
     results['vulnerable'] = recap['vulnerable']
     results['sus'] = recap['sus']
     results['projects_scanned'] = recap['projects_scanned']    
-    scanner.write_output_file(resultsfile, results) 
+    scanner.write_output_file(resultsfile, results)
+    checkpoint.close()
+    scanner.FILESCANNER.print_cache_stats() 
 
 
 if __name__ == '__main__':
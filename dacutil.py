@@ -5,10 +5,16 @@
 # For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 #
 import json
+import time
 import click
 import os
 import urllib
 from contentscanner import Scanner
+from lookupcache import LookupCache
+from localscanner import LocalScanner
+from resultswriter import ResultsWriter
+from checkpoint import Checkpoint
+import snapshot
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -29,7 +35,10 @@ def check_file(filename, resultsfile):
             data = f.read()
         FILESCANNER = Scanner("./modules", "modules.json")
         singleresult = FILESCANNER.scan_contents(os.path.basename(filename), data)
+        if 'errors' not in singleresult:
+            FILESCANNER.retry_unresolved(list(singleresult.items()))
         write_output_file(resultsfile, singleresult)
+        FILESCANNER.print_cache_stats()
     except Exception as e:
         print(f"Error: {e} in check_file")
 
@@ -44,10 +53,113 @@ def check_url(manifestname, url, resultsfile):
         FILESCANNER = Scanner("./modules", "modules.json")
         data = urllib.request.urlopen(url).read().decode('ascii')
         singleresult = FILESCANNER.scan_contents(os.path.basename(manifestname), data)
+        if 'errors' not in singleresult:
+            FILESCANNER.retry_unresolved(list(singleresult.items()))
         write_output_file(resultsfile, singleresult)
+        FILESCANNER.print_cache_stats()
     except Exception as e:
         print(f"Error: {e} in check_url")
 
+#checks every checkout under a local directory
+@dazed_and_confused.command('dir', short_help='scans every repo checked out under a local directory')
+@click.option("-path", "-p", required=True, help="directory to scan (each checkout under it is scanned as a repo)")
+@click.option("-resultsfile", "-rf", required=True, help="results file name")
+@click.option('--conc', "-c", default=20, show_default=True, help='Number of concurrent manifest scans per process')
+@click.option('--procs', default=3, show_default=True, help='Number of concurrent processes to use for scanning repos (roughly, how many cores to use)')
+@click.option('--stream', '-s', is_flag=True, help="stream results to the results file as NDJSON (one line per repo) as they finish")
+@click.option('--resume', is_flag=True, help="resume an interrupted scan from its journal (<resultsfile>.journal), skipping repos it already finished")
+def check_dir(path, resultsfile, conc, procs, stream, resume):
+    """ The [dir] command scans every repo checked out under a local directory """
+    scan_local(path, 'dir', resultsfile, conc, procs, stream, resume, False)
+
+#checks every bare repo (mirror) under a local directory, reading manifests straight from the git objects
+@dazed_and_confused.command('mirror', short_help='scans every bare repo (mirror) under a local directory')
+@click.option("-path", "-p", required=True, help="directory of bare repos (e.g. made with git clone --mirror)")
+@click.option("-resultsfile", "-rf", required=True, help="results file name")
+@click.option('--conc', "-c", default=20, show_default=True, help='Number of concurrent manifest scans per process')
+@click.option('--procs', default=3, show_default=True, help='Number of concurrent processes to use for scanning repos (roughly, how many cores to use)')
+@click.option('--stream', '-s', is_flag=True, help="stream results to the results file as NDJSON (one line per repo) as they finish")
+@click.option('--resume', is_flag=True, help="resume an interrupted scan from its journal (<resultsfile>.journal), skipping repos it already finished")
+@click.option('--incremental', '-i', is_flag=True, help="reuse the last results for repos/manifests whose sha hasn't changed since the previous incremental scan")
+def check_mirror(path, resultsfile, conc, procs, stream, resume, incremental):
+    """ The [mirror] command scans every bare repo under a local directory """
+    scan_local(path, 'mirror', resultsfile, conc, procs, stream, resume, incremental)
+
+#runs a dir or mirror scan and writes out the results
+def scan_local(path, kind, resultsfile, conc, procs, stream, resume, incremental):
+    try:
+        scanner = LocalScanner(conc, procs, incremental)
+        starttime = time.time()
+        checkpoint = Checkpoint(resultsfile + ".journal", resume)
+        if stream:
+            writer = ResultsWriter(resultsfile, scanner.get_repo_counts)
+            scanner.scan_all_repos(path, kind, writer, checkpoint)
+            writer.close({'repos_scanned': writer.totals['scanned'], 'vulnerable': writer.totals['vulnerable'], 'sus': writer.totals['sus'], 'time_elapsed': time.time() - starttime})
+        else:
+            results = scanner.scan_all_repos(path, kind, None, checkpoint)
+            results.update(scanner.get_recap(results))
+            write_output_file(resultsfile, results)
+        checkpoint.close()
+    except Exception as e:
+        print(f"Error: {e} in scan_local")
+
+@dazed_and_confused.group('cache', short_help='inspects or prunes the persistent registry lookup cache')
+def cache():
+    """ The [cache] commands inspect or prune the persistent registry lookup cache """
+    pass
+
+#prints per registry counts for the lookup cache
+@cache.command('stats', short_help='shows per registry counts of cached lookups')
+def cache_stats():
+    """ The [stats] command shows per registry counts of cached lookups """
+    try:
+        lookupcache = LookupCache()
+        print(lookupcache.path)
+        print(json.dumps(lookupcache.stats(), indent=4))
+    except Exception as e:
+        print(f"Error: {e} in cache_stats")
+
+#prints the cached lookups for a single package
+@cache.command('show', short_help='shows the cached lookups for a package')
+@click.option("-name", "-n", required=True, help="package name (group:artifactId for maven)")
+@click.option("-registry", "-r", default=None, help="registry (npm, pypi, rubygems, packagist, maven, cocoapods)")
+def cache_show(name, registry):
+    """ The [show] command shows the cached lookups for a package """
+    try:
+        print(json.dumps(LookupCache().lookup(name, registry), indent=4))
+    except Exception as e:
+        print(f"Error: {e} in cache_show")
+
+#removes expired (or all) lookups from the cache
+@cache.command('prune', short_help='removes expired lookups from the cache')
+@click.option("-registry", "-r", default=None, help="only prune this registry")
+@click.option('--all', '-a', 'prune_all', is_flag=True, help="remove every lookup, not just expired ones")
+def cache_prune(registry, prune_all):
+    """ The [prune] command removes expired (or all) lookups from the cache """
+    try:
+        removed = LookupCache().prune(registry, not prune_all)
+        print(f"Removed {removed} lookups")
+    except Exception as e:
+        print(f"Error: {e} in cache_prune")
+
+#builds an offline index of package names for a registry
+@dazed_and_confused.command('snapshot', short_help='builds an offline index of the package names in a public registry')
+@click.option("-registry", "-r", required=True, type=click.Choice(list(snapshot.SOURCES) + ['all']), help="registry to snapshot")
+@click.option("-source", "-s", default=None, help="url or local file of names (one per line) to build from instead of the registry (required for maven, as group:artifactId, not allowed with all)")
+def build_snapshot(registry, source):
+    """ The [snapshot] command builds an offline index of the package names in a public registry """
+    #a source only holds one registry's names, building every registry from it would give them all the same index
+    if registry == 'all' and source:
+        raise click.UsageError("-source can only be used with a single registry, not all")
+    registries = [x for x in snapshot.SOURCES if snapshot.SOURCES[x]] if registry == 'all' else [registry]
+    for reg in registries:
+        try:
+            starttime = time.time()
+            count = snapshot.build(reg, source)
+            print(f"{reg}: {count} names ({time.time() - starttime:.1f}s) - {snapshot.get_path(reg)}")
+        except Exception as e:
+            print(f"Error: {e} in build_snapshot({reg})")
+
 #writes json output to filename
 def write_output_file(resultsfile, resultsjson, print_name=True):
     try:
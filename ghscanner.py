@@ -9,58 +9,172 @@ import time
 import json
 import os
 import multiprocessing
+import multiprocessing.connection
+import threading
+import queue
+import collections
+import base64
+import dac_constants
 from github3 import GitHub, GitHubEnterprise
-from contentscanner import Scanner
+from basescanner import BaseScanner
+from contentscanner import Scanner, set_scan_procs
+from scanstate import ScanState
+from ratelimiter import GitHubLimiter, RateLimitedAdapter
+import registryclient
 
-class GHScanner:
+#the fields we need for each repo, fetched in bulk when listing an org (so no per repo lookups are needed)
+REPO_FIELDS = """
+    name
+    isArchived
+    isFork
+    isEmpty
+    defaultBranchRef { name target { oid ... on Commit { tree { oid } } } }
+"""
 
-    def __init__(self, conc=200, procs=4, public=False):
-        self.RateWarning = False
+REPOS_QUERY = """
+query($org: String!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: 100, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %s }
+    }
+  }
+}
+""" % REPO_FIELDS
+
+REPO_QUERY = """
+query($org: String!, $repo: String!) {
+  repository(owner: $org, name: $repo) { %s }
+}
+""" % REPO_FIELDS
+
+class GHScanner(BaseScanner):
+
+    def __init__(self, conc=200, procs=4, public=False, incremental=False, limiter=None):
         self.conc = conc
         self.procs = procs
         self.public = public
+        self.incremental = incremental
+        super().__init__()
+        #previous results, so unchanged repos/manifests arent fetched and scanned again
+        self.STATE = ScanState() if incremental else None
         #GitHub API wrapper
         if public:
             self.GH = GitHub(os.getenv("GITHUB_URL"), token=os.getenv("GITHUB_AUTH"))
         else:
             self.GH = GitHubEnterprise(os.getenv("GITHUB_URL"), token=os.getenv("GITHUB_AUTH"), verify=False)
+        #every API call is paced through one limiter (shared with the worker processes of a full scan)
+        self.LIMITER = limiter or GitHubLimiter()
+        adapter = RateLimitedAdapter(self.LIMITER, pool_maxsize=conc)
+        self.GH.session.mount('https://', adapter)
+        self.GH.session.mount('http://', adapter)
+        #rest calls go to <server>/api/v3 on enterprise, graphql to <server>/api/graphql (api.github.com/graphql for public)
+        self.API_URL = self.GH.session.base_url.rstrip('/')
+        self.GRAPHQL_URL = self.API_URL[:-len('/v3')] + '/graphql' if self.API_URL.endswith('/api/v3') else self.API_URL + '/graphql'
 
         self.FILESCANNER = Scanner("./modules", "modules.json")
 
     #scans all orgs in git server
-    def scan_all_orgs(self):
+    #orgs and repos are tasks handed out to whichever worker process has a thread free,
+    #so a huge org is spread over all the processes instead of pinning one of them
+    #with a writer, repos are streamed to it as they finish instead of being collected in memory
+    #with a checkpoint, finished repos/orgs are journaled, and anything already in it is reused instead of rescanned
+    def scan_all_orgs(self, writer=None, checkpoint=None):
         starttime = time.time()
         results = {'orgs_scanned': 0, 'repos_scanned': 0, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'orgs':[]}
         print("Retrieving org list...")
         orgslist = self.check_orgs()
         print(f"Done - {len(orgslist)} items retrieved!")
         try:
-            #chunk the list of orgs for co-processing
-            orgchunks = list(self.chunks(orgslist, self.procs))
-            processes = []
-            rets = []
-            
-            #run each chunk with a different process
-            resultqueue = multiprocessing.Queue()
-            for chunk in orgchunks:
-                tmp = multiprocessing.Process(target=self.check_org_chunk, args=(resultqueue, chunk, self.conc, self.procs, self.public))
-                processes.append(tmp)
-                tmp.start()
-            for process in processes:
-                res = resultqueue.get()
-                rets = rets + res
-            for process in processes:
-                process.join()
-            results['orgs'] = rets
-
-            #error check
-            for org in results['orgs']:
-                if 'errors' in org:
-                    for repo in org['errors']:
-                        print(f"Retrying: {repo}...")
-                        tmp = self.check_single_repo(org['org'], repo)
-                        index = next((index for (index, d) in enumerate(org['repos']) if d["repo"] == repo), None)
-                        org['repos'][index] = tmp
+            orgs = {}
+
+            #pull in the repos finished by a previous run, every org is still listed again so the repos it didnt finish
+            #(errored, still unresolved, or never reached) get scanned
+            skip = {}
+            if checkpoint:
+                for org in orgslist:
+                    skip[org] = set(self.resume_org(orgs, writer, checkpoint, org))
+            todo = orgslist
+
+            #each org starts as a task to list its repos, which then turns into a task per repo
+            #tasks are handed to the workers from here, up to conc at a time each (one per thread), so we always know what
+            #a worker has in progress: if it dies (killed for running out of memory, say) those tasks fail and are retried
+            tasks = collections.deque(('org', org, None) for org in todo)
+            finished = multiprocessing.Event()
+            workers = {i: self.start_worker(finished) for i in range(min(self.procs, len(todo)))}
+            nextworker = len(workers)
+
+            #org: {'start', 'pending' (repos not finished yet, None while listing), 'errors'}
+            progress = {org: {'start': time.time(), 'pending': None, 'errors': []} for org in todo}
+            attempts = {}
+            counts = {'listing': len(todo), 'queued': 0, 'done': 0, 'retried': 0}
+            lastprint = time.time()
+            while counts['listing'] > 0 or counts['queued'] > 0:
+                if not workers:
+                    print("Error: all scan workers died, stopping early in scan_all_orgs")
+                    break
+                for worker in workers.values():
+                    while tasks and len(worker['inflight']) < self.conc:
+                        task = tasks.popleft()
+                        worker['inflight'][self.get_task_key(task)] = task
+                        worker['tasks'].put(task)
+                multiprocessing.connection.wait([w['conn'] for w in workers.values()] + [w['process'].sentinel for w in workers.values()], dac_constants.STATUS_INTERVAL)
+                finished_tasks = []
+                for wid, worker in list(workers.items()):
+                    finished_tasks += self.read_results(worker)
+                    if worker['process'].exitcode is None:
+                        continue
+                    #a dead worker's tasks fail (so repos are retried like any other errored repo), and a new worker takes its place
+                    del workers[wid]
+                    worker['tasks'].cancel_join_thread()
+                    if worker['inflight']:
+                        print(f"Error: a scan worker died with {len(worker['inflight'])} tasks in progress in scan_all_orgs")
+                        workers[nextworker] = self.start_worker(finished)
+                        nextworker += 1
+                    for kind, org, name in worker['inflight']:
+                        finished_tasks.append(('repos', org, None) if kind == 'org' else ('repo', org, {name: [], 'errors': [f"worker died in check_single_repo({name})"]}))
+                for kind, org, res in finished_tasks:
+                    if kind == 'repos':
+                        counts['listing'] -= 1
+                        if res is None:
+                            progress[org]['errors'].append(f"check_single_org({org})")
+                            res = []
+                        repos = [repo for repo in res if repo['name'] not in skip.get(org, ())]
+                        progress[org]['pending'] = len(repos)
+                        counts['queued'] += len(repos)
+                        tasks.extend(('repo', org, repo) for repo in repos)
+                    else:
+                        repo = next(iter(res))
+                        #errored repos go back on the queue (another worker will likely pick them up)
+                        if 'errors' in res and attempts.get((org, repo), 0) < dac_constants.REPO_RETRIES:
+                            attempts[(org, repo)] = attempts.get((org, repo), 0) + 1
+                            counts['retried'] += 1
+                            print(f"Retrying: {repo}...")
+                            tasks.append(('repo', org, repo))
+                            continue
+                        if 'errors' in res:
+                            progress[org]['errors'].append(repo)
+                        self.add_repo_result(orgs, writer, org, res, checkpoint)
+                        progress[org]['pending'] -= 1
+                        counts['queued'] -= 1
+                        counts['done'] += 1
+                    if progress[org]['pending'] == 0:
+                        summary = {'scan_time': time.time() - progress[org]['start']}
+                        if progress[org]['errors']:
+                            summary['errors'] = progress[org]['errors']
+                        orgs.setdefault(org, {org: []}).update(summary)
+                        print(f"{org} ({summary['scan_time']})")
+                        del progress[org]
+                #live view of how much work is left
+                if time.time() - lastprint >= dac_constants.STATUS_INTERVAL:
+                    print(f"Queue: {counts['queued']} repos left, {counts['listing']} orgs still listing, {counts['done']} repos done, {counts['retried']} retried")
+                    lastprint = time.time()
+
+            finished.set()
+            for worker in workers.values():
+                worker['process'].join()
+            self.finish_unresolved(orgs, writer)
+            results['orgs'] = list(orgs.values())
 
             #do recap
             results['time_elapsed'] = time.time() - starttime
@@ -70,6 +184,42 @@ class GHScanner:
         except Exception as e:
             print(f"Error: {e} in scan_all_orgs")
 
+    #scans a single org (used by the all command), streaming/journaling like scan_all_orgs
+    def scan_org(self, org, writer=None, checkpoint=None):
+        orgs = {}
+        skip = []
+        if checkpoint:
+            skip = self.resume_org(orgs, writer, checkpoint, org)
+        res = self.check_single_org(org, lambda o, r: self.add_repo_result(orgs, writer, o, r, checkpoint), skip)
+        del res[org]
+        orgs.setdefault(org, {org: []}).update(res)
+        self.finish_unresolved(orgs, writer)
+        return orgs[org]
+
+    #adds the repos a previous run finished for an org, returns the names of those repos
+    #(only clean repos are journaled, so anything else in the org is scanned again)
+    def resume_org(self, orgs, writer, checkpoint, org):
+        repos = []
+        for key, res in checkpoint.find(f"repo/{org}/"):
+            self.add_repo_result(orgs, writer, org, res)
+            repos.append(next(iter(res)))
+        return repos
+
+    #streams a repo result to the writer, or adds it to its org in the results (and journals it, if it scanned cleanly)
+    def add_repo_result(self, orgs, writer, org, res, checkpoint=None):
+        self.add_result((org, res), res, f"repo/{org}/{next(iter(res))}", writer, checkpoint, lambda result: orgs.setdefault(org, {org: []})[org].append(res))
+
+    #retries the lookups that failed during the scan, then writes out any streamed repos that were held back for them
+    def finish_unresolved(self, orgs, writer=None):
+        self.retry_results([(org, res) for org, o in orgs.items() for res in o[org]], writer)
+
+    #results are handed around as (org, repo result)
+    def get_result_files(self, result):
+        return self.get_repo_files(result[1])
+
+    def get_result_record(self, result):
+        return self.get_repo_record(result[1], result[0])
+
     # get list of orgs
     def check_orgs(self):
         results = []
@@ -83,12 +233,15 @@ class GHScanner:
         return results
 
     #checks a single gh organization
-    def check_single_org(self, org):
+    #on_repo(org, result), if given, is called for each repo as it finishes instead of collecting them
+    #repos in skip (already scanned by an earlier run) are left out
+    def check_single_org(self, org, on_repo=None, skip=()):
         jsonresult = {org:[], 'errors': []}
         starttime = time.time()
         try:
             #load up the repos for this org
-            repos = self.check_repos(org)
+            skip = set(skip)
+            repos = [repo for repo in self.check_repos(org) if repo['name'] not in skip]
             #check each repo with a new thread (up to n=conc threads)
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.conc) as executor:
                 fut = [executor.submit(self.check_single_repo, org, repository) for repository in repos]
@@ -96,8 +249,11 @@ class GHScanner:
                     #if there is an error, ad it to the error list
                     scanresult = r.result()
                     if 'errors' in scanresult:
-                        jsonresult['errors'].append(scanresult['repo'])
-                    jsonresult[org].append(scanresult)
+                        jsonresult['errors'].append(next(iter(scanresult)))
+                    if on_repo:
+                        on_repo(org, scanresult)
+                    else:
+                        jsonresult[org].append(scanresult)
 
         except Exception as e:
             print(f"Error: {e} in check_single_org({org})")
@@ -107,108 +263,155 @@ class GHScanner:
         jsonresult['scan_time'] = time.time() - starttime
         return jsonresult
 
-    # gets a list of repos for a git org
+    # gets the repos for a git org (100 at a time through graphql, with everything check_single_repo needs)
+    # empty repos (and archived ones, if SKIP_ARCHIVED is set) are left out, they have nothing to scan
     def check_repos(self, org):
         ret = []
         try:
-            organization = self.GH.organization(org)
-            repos = organization.repositories(type="all")
-            for repo in repos:
-                ret.append(repo.name)
+            cursor = None
+            while True:
+                data = self.graphql(REPOS_QUERY, {'org': org, 'cursor': cursor})['organization']['repositories']
+                for node in data['nodes']:
+                    repo = self.get_repo_info(node)
+                    if not repo['empty'] and not (repo['archived'] and dac_constants.SKIP_ARCHIVED):
+                        ret.append(repo)
+                if not data['pageInfo']['hasNextPage']:
+                    break
+                cursor = data['pageInfo']['endCursor']
         except Exception as e:
             print(f"Error: {e} in check_repos")
             raise
         return ret
 
+    #gets the info for a single repo by name (for repos that didnt come from check_repos)
+    def get_repo(self, org, repo):
+        return self.get_repo_info(self.graphql(REPO_QUERY, {'org': org, 'repo': repo})['repository'])
+
+    #flattens a graphql repo node
+    @staticmethod
+    def get_repo_info(node):
+        ref = node['defaultBranchRef']
+        return {
+            'name': node['name'],
+            'default_branch': ref['name'] if ref else None,
+            'head': ref['target']['oid'] if ref else None,
+            'tree': ref['target']['tree']['oid'] if ref else None,
+            'archived': node['isArchived'],
+            'fork': node['isFork'],
+            'empty': node['isEmpty'] or ref is None
+        }
+
+    #runs a graphql query, returns its data
+    def graphql(self, query, variables):
+        res = self.GH.session.post(self.GRAPHQL_URL, json={'query': query, 'variables': variables})
+        res.raise_for_status()
+        data = res.json()
+        if data.get('errors'):
+            raise Exception(data['errors'][0].get('message'))
+        return data['data']
+
+    #GETs a rest api path (e.g. repos/org/repo/git/trees/sha), returns the json
+    def get_json(self, path, params=None):
+        res = self.GH.session.get(f"{self.API_URL}/{path}", params=params)
+        res.raise_for_status()
+        return res.json()
+
     # checks a single repo for dependency confusion (now with threading!)
+    # repo is the info from check_repos, or just a name (which is then looked up)
     def check_single_repo(self, org, repo):
-        jsonresult = {repo: [], 'errors': []}
+        name = repo['name'] if isinstance(repo, dict) else repo
+        jsonresult = {name: [], 'errors': []}
         try:
-            #check rate limits and sleep if need be
-            core = self.GH.rate_limit()['resources']['core']
-            if int(core['remaining']) < 500:
-                resettime = int(core['reset'])
-                sleepamount = resettime - int(time.time())
-                
-                #if we havent said we are pausing yet, do so now
-                if not self.RateWarning:
-                    print(f"GIT API RATE LIMIT HIT, SLEEPING FOR: {sleepamount} seconds")
-                    self.RateWarning = True
-
-                #pause until the rate limiter resets
-                time.sleep(sleepamount + 2)
-                self.RateWarning = False
-
-            repository = self.GH.repository(org, repo)
+            info = repo if isinstance(repo, dict) else self.get_repo(org, repo)
+            repo = name
+            if info['empty']:
+                del jsonresult['errors']
+                return jsonresult
+
+            #in incremental mode, a repo whose HEAD hasnt moved just reuses its last result
+            key = f"github/{org}/{repo}"
+            head = None
+            if self.STATE:
+                head = info['head']
+                previous = self.STATE.get_repo(key, head)
+                if previous is not None:
+                    jsonresult[repo] = previous
+                    del jsonresult['errors']
+                    return jsonresult
+
             #grab packages from this repo and pull the dependencies from them
-            files = self.check_repo(repository)
-            filecontents = self.get_all_manifest_contents(files, repository)
+            #(manifests whose blob sha hasnt changed since the last scan reuse their last result)
+            scanned, todo = self.FILESCANNER.split_manifests(self.STATE, key, self.check_repo(org, info))
+            jsonresult[repo] += [row['result'] for row in scanned]
+            shas = {file['name']: file['sha'] for file in todo}
+            filecontents = self.get_all_manifest_contents(todo, org, info)
+            context = self.FILESCANNER.get_repo_context(filecontents)
             for file in filecontents:
                 #scan it
-                scanresult = self.FILESCANNER.scan_contents(file['file'], file['content'], file['override'])
+                scanresult = self.FILESCANNER.scan_contents(file['file'], file['content'], file['override'], context)
 
                 #if we had errors, bubble them up
                 if 'errors' in scanresult:
                     jsonresult['errors'].append(scanresult['errors'])
                 else:
                     jsonresult[repo].append(scanresult)
-            #remove empty errors
+                    if 'unresolved' not in scanresult[file['file']]:
+                        scanned.append({'path': file['file'], 'sha': shas[file['file']], 'override': file['override'], 'result': scanresult})
+            #remove empty errors (and remember clean results for next time)
             if len(jsonresult['errors']) == 0:
                 del jsonresult['errors']
+                if self.STATE:
+                    self.STATE.put_repo(key, head, jsonresult[repo], scanned)
 
         except Exception as e:
-            if "new thread" not in str(e) and "repository is empty" not in str(e):
-                print(f"{org} : {repo} : Error: {e} in check_single_repo")
+            if "new thread" not in str(e):
+                print(f"{org} : {name} : Error: {e} in check_single_repo")
         return jsonresult
 
-    #traverses a git repo and finds manifest files 
-    def check_repo(self, repo):
+    #traverses a git repo (all of it, with one recursive tree call on its HEAD tree) and finds manifest files 
+    def check_repo(self, org, info):
         files = []
         try:
-            contents = repo.directory_contents("", return_as=dict)
-            overrides = []
-            for file in contents:
-                f = contents[file]
-                for module in self.FILESCANNER.MODULES['modules']:
-                    if f.path.lower() in module['manifest_file'] or f.path.lower() in module['lock_file'] or ('config_file' in module and f.path.lower() == module['config_file']):
-                        if 'config_file' in module and f.path.lower() == module['config_file']:
-                            if module['config_parse_func'](get_single_manifest_contents(repo, {'name': f.path, 'override': False})):
-                                overrides = overrides + module['manifest_file'] + module['lock_file']
-                        else:
-                            files.append({'name': f.path, 'override': False})
-                            if f.path.lower() in module['lock_file']:
-                                for file in module['manifest_file'] + module['lock_file'][:-1]:
-                                    if not f.path.lower() == file.lower():
-                                        overrides.append(file)             
-                        break
-            overrides = list(set(overrides))
-            for f in files:
-                if f['name'] in overrides:
-                    f['override'] = True
+            tree = self.get_json(f"repos/{org}/{info['name']}/git/trees/{info['tree']}", {'recursive': '1'})
+            if tree.get('truncated'):
+                print(f"{org}/{info['name']} : tree truncated, some manifests may be missed")
+            entries = [{'path': f['path'], 'sha': f['sha']} for f in tree['tree'] if f['type'] == 'blob']
+            files = self.FILESCANNER.find_manifests(entries, lambda entry: self.get_single_manifest_contents(org, info, {'name': entry['path'], 'sha': entry['sha'], 'override': False}))
         except Exception as e:
             #print(f"Error: {e} in check_repo")
             raise
         return files
 
     #grabs manifest file contents from git (but with threads this time!)
-    def get_single_manifest_contents(self, repo, file):
+    def get_single_manifest_contents(self, org, info, file):
         try:
             if file['override']:
                 return {'file': file['name'], 'content': '', 'override': True}
-            content = repo.file_contents(file['name']).decoded.decode("utf-8")
+            #fetched by blob sha, straight from the tree listing
+            blob = self.get_json(f"repos/{org}/{info['name']}/git/blobs/{file['sha']}")
+            content = base64.b64decode(blob['content']).decode("utf-8")
             return {'file': file['name'], 'content': content, 'override': False}
         except Exception as e:
             #print(f"Error: {e} in ({filename}) get_single_manifest_contents")
             raise
 
     #grabs all manifest file contents from git
-    def get_all_manifest_contents(self, files, repo):
+    def get_all_manifest_contents(self, files, org, info):
         if not files or len(files) == 0:
             return []
-        filecontents = []
+        filecontents = [{'file': file['name'], 'content': '', 'override': True} for file in files if file['override']]
+        files = [file for file in files if not file['override']]
         try:
+            #pull the manifests in bulk first, anything that doesnt come back that way is fetched on its own
+            try:
+                bulk = self.get_manifest_blobs(org, info, files)
+            except Exception as e:
+                print(f"{org} : {info['name']} : Error: {e} in get_manifest_blobs")
+                bulk = {}
+            filecontents += [{'file': name, 'content': content, 'override': False} for name, content in bulk.items()]
+            files = [file for file in files if file['name'] not in bulk]
             with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                fut = [executor.submit(self.get_single_manifest_contents, repo, file) for file in files]
+                fut = [executor.submit(self.get_single_manifest_contents, org, info, file) for file in files]
                 for r in concurrent.futures.as_completed(fut):
                     tmp = r.result()
                     if tmp is not None:
@@ -219,25 +422,91 @@ class GHScanner:
             raise
         return filecontents
 
-    #Yield n number of striped chunks from l.
-    @staticmethod
-    def chunks(l, n):
-        for i in range(0, n):
-            yield l[i::n]
-            
-    #checks a list of orgs for dependency confusion  
+    #fetches the text of a repo's manifests by blob sha, MANIFEST_BATCH of them per graphql call
+    #returns name: content for the ones that came back (binary or truncated blobs are left for a rest call)
+    def get_manifest_blobs(self, org, info, files):
+        contents = {}
+        for i in range(0, len(files), dac_constants.MANIFEST_BATCH):
+            batch = files[i:i + dac_constants.MANIFEST_BATCH]
+            fields = " ".join(f'f{n}: object(oid: "{file["sha"]}") {{ ... on Blob {{ text isTruncated }} }}' for n, file in enumerate(batch))
+            query = f"query($org: String!, $repo: String!) {{ repository(owner: $org, name: $repo) {{ {fields} }} }}"
+            data = self.graphql(query, {'org': org, 'repo': info['name']})['repository']
+            for n, file in enumerate(batch):
+                blob = data.get(f"f{n}")
+                if blob and blob.get('text') is not None and not blob.get('isTruncated'):
+                    contents[file['name']] = blob['text']
+        return contents
+
+    #starts a worker process for scan_all_orgs, with its own task queue and a pipe its results come back on
+    def start_worker(self, finished):
+        tasks = multiprocessing.Queue()
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=self.scan_worker, args=(tasks, writer, finished, self.conc, self.procs, self.public, self.incremental, self.LIMITER, registryclient.get_limiters()))
+        process.start()
+        #only the worker writes to the pipe, so it reads as closed once the worker is gone
+        writer.close()
+        return {'process': process, 'tasks': tasks, 'conn': reader, 'inflight': {}}
+
+    #reads the results a worker has sent back so far, dropping their tasks from the ones it has in progress
     @staticmethod
-    def check_org_chunk(resultqueue, orgs, conc, procs, public=False):
+    def read_results(worker):
         results = []
         try:
-            ghscanner = GHScanner(conc, procs, public)
-            for org in orgs:
-                res = ghscanner.check_single_org(org)
-                results.append(res)
-                print(f"{org} ({res['scan_time']})")
+            while worker['conn'].poll():
+                kind, org, res = worker['conn'].recv()
+                worker['inflight'].pop(('org', org, None) if kind == 'repos' else ('repo', org, next(iter(res))), None)
+                results.append((kind, org, res))
+        except Exception:
+            #the worker died (maybe part way through sending)
+            pass
+        return results
+
+    #identifies a task ('org', org, None) or ('repo', org, info or name) by (kind, org, repo name)
+    @staticmethod
+    def get_task_key(task):
+        kind, org, repo = task
+        return (kind, org, repo['name'] if isinstance(repo, dict) else repo)
+
+    #worker process for scan_all_orgs, runs conc threads that all pull tasks from its queue until the scan is finished
+    @staticmethod
+    def scan_worker(taskqueue, conn, finished, conc, procs, public=False, incremental=False, limiter=None, registry_limiters=None):
+        try:
+            #pace registry lookups against the same per-host budgets as every other worker
+            if registry_limiters:
+                registryclient.set_limiters(registry_limiters)
+            #the cores are shared with the other workers, so this one gets a share of them for parsing
+            set_scan_procs(procs)
+            ghscanner = GHScanner(conc, procs, public, incremental, limiter)
+            #the threads share the pipe back, one message at a time
+            lock = threading.Lock()
+            def send(result):
+                with lock:
+                    conn.send(result)
+            threads = [threading.Thread(target=ghscanner.scan_worker_thread, args=(taskqueue, send, finished)) for i in range(conc)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            ghscanner.FILESCANNER.RESOLVER.shutdown()
+            ghscanner.FILESCANNER.print_cache_stats()
         except Exception as e:
-            print(f"Error: {e} in check_org_chunk")
-        resultqueue.put(results)
+            print(f"Error: {e} in scan_worker")
+
+    #lists an org's repos or scans a single repo, one task at a time, sending the results back to scan_all_orgs
+    def scan_worker_thread(self, taskqueue, send, finished):
+        while not finished.is_set():
+            try:
+                kind, org, repo = taskqueue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if kind == 'org':
+                try:
+                    repos = self.check_repos(org)
+                except Exception:
+                    repos = None
+                send(('repos', org, repos))
+            else:
+                send(('repo', org, self.check_single_repo(org, repo)))
 
     #get recap info for the dac.py file
     @staticmethod
@@ -246,8 +515,8 @@ class GHScanner:
         v = 0
         s = 0
         for org in results['orgs']:
-            r += len(org)
             oname = next(iter(org))
+            r += len(org[oname])
             for repo in org[oname]:
                 rname = next(iter(repo))
                 for file in repo[rname]:
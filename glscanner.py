@@ -5,54 +5,99 @@
 # For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 #
 import concurrent.futures
+import threading
 import time
 import json
 import os
 import gitlab
 import base64
+from basescanner import BaseScanner
 from contentscanner import Scanner
+import dac_constants
+from scanstate import ScanState
 
-class GLScanner:
+#pulls the raw contents of a list of files in one call
+BLOBS_QUERY = """
+query($project: ID!, $ref: String!, $paths: [String!]!) {
+  project(fullPath: $project) {
+    repository {
+      blobs(ref: $ref, paths: $paths) { nodes { path rawBlob } }
+    }
+  }
+}
+"""
 
-    def __init__(self, conc=200):
+class GLScanner(BaseScanner):
+
+    def __init__(self, conc=200, incremental=False):
         self.RateWarning = False
         self.conc = conc
+        super().__init__()
+        #previous results, so unchanged projects/manifests arent fetched and scanned again
+        self.STATE = ScanState() if incremental else None
         #GitHub API wrapper
         self.GL = gitlab.Gitlab(os.getenv("GITLAB_URL"), private_token=os.getenv("GITLAB_AUTH"))
+        self.GRAPHQL_URL = f"{(os.getenv('GITLAB_URL') or '').rstrip('/')}/api/graphql"
         self.FILESCANNER = Scanner("./modules", "modules.json")
         
     # checks a single repo for dependency confusion (now with threading!)
+    #project is an id, or a project straight from the listing (which saves fetching it again)
     def check_single_project(self, project):
-        jsonresult = {'project': "", 'id': project, 'files': [], 'errors': []}
+        listed = not isinstance(project, (str, int))
+        jsonresult = {'project': "", 'id': project.id if listed else project, 'files': [], 'errors': []}
         if isinstance(project, str) and not project.isnumeric():
             return jsonresult
         starttime = time.time()
         try:
-            project = self.GL.projects.get(project)
+            if not listed:
+                project = self.GL.projects.get(project)
             jsonresult['project'] = project.name
+
+            #an empty project has no default branch, and nothing to scan
+            if not project.default_branch:
+                del jsonresult['errors']
+                jsonresult['scan_time'] = time.time() - starttime
+                return jsonresult
+
+            #in incremental mode, a project whose HEAD hasnt moved just reuses its last result
+            key = f"gitlab/{project.id}"
+            head = None
+            if self.STATE:
+                head = project.branches.get(project.default_branch).commit['id']
+                previous = self.STATE.get_repo(key, head)
+                if previous is not None:
+                    jsonresult['files'] = previous
+                    del jsonresult['errors']
+                    jsonresult['scan_time'] = time.time() - starttime
+                    return jsonresult
+
             #grab packages from this repo and pull the dependencies from them
-            files = self.check_gitlab_repo(project)
-            filecontents = self.get_all_gitlab_manifest_contents(files, project)
-            res = []
+            #(manifests whose blob sha hasnt changed since the last scan reuse their last result)
+            scanned, todo = self.FILESCANNER.split_manifests(self.STATE, key, self.check_gitlab_repo(project), 'id')
+            jsonresult['files'] += [row['result'] for row in scanned]
+            shas = {file['name']: file['id'] for file in todo}
+            filecontents = self.get_all_gitlab_manifest_contents(todo, project)
+            context = self.FILESCANNER.get_repo_context(filecontents)
             for file in filecontents:
                 contents = file['content']
                 #if it aint a string, make it one
                 if not isinstance(file['content'], str):
                     contents = json.dumps(file['content'])
 
-                if not file['override']:
-                    scanresult = self.FILESCANNER.scan_contents(file['file'], contents)
-                else:
-                    scanresult = {'result': {'file': file['file'], 'vulnerable': [], 'sus': [], 'override': True}}
+                scanresult = self.FILESCANNER.scan_contents(file['file'], contents, file['override'], context)
                     
                 #bubble errors
                 if 'errors' in scanresult:
                     jsonresult['errors'].append(file['file'])
                 else:
-                    jsonresult['files'].append(scanresult['result'])
+                    jsonresult['files'].append({'file': file['file'], **scanresult[file['file']]})
+                    if 'unresolved' not in jsonresult['files'][-1]:
+                        scanned.append({'path': file['file'], 'sha': shas[file['file']], 'override': file['override'], 'result': jsonresult['files'][-1]})
 
             if len(jsonresult['errors']) == 0:
-                   del jsonresult['errors']
+                del jsonresult['errors']
+                if self.STATE:
+                    self.STATE.put_repo(key, head, jsonresult['files'], scanned)
             jsonresult['scan_time'] = time.time() - starttime
             
         except Exception as e:
@@ -63,8 +108,17 @@ class GLScanner:
     def get_all_gitlab_manifest_contents(self, files, project):
         if not files:
             return []
-        filecontents = []
+        filecontents = [{'file': file['name'], 'content': '', 'override': True} for file in files if file['override']]
+        files = [file for file in files if not file['override']]
         try:
+            #pull the manifests in bulk first, anything that doesnt come back that way is fetched on its own
+            try:
+                bulk = self.get_gitlab_manifest_blobs(files, project)
+            except Exception as e:
+                print(f"Error: {e} in get_gitlab_manifest_blobs({project.id})")
+                bulk = {}
+            filecontents += [{'file': name, 'content': content, 'override': False} for name, content in bulk.items()]
+            files = [file for file in files if file['name'] not in bulk]
             #grabs the file contents for all found files concurrently
             with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
                 fut = [executor.submit(self.get_single_gitlab_manifest_contents, file, project, ) for file in files]
@@ -78,6 +132,23 @@ class GLScanner:
             raise
         return filecontents
 
+    #fetches the contents of a project's manifests through graphql, MANIFEST_BATCH of them per call
+    #returns name: content for the ones that came back
+    def get_gitlab_manifest_blobs(self, files, project):
+        contents = {}
+        for i in range(0, len(files), dac_constants.MANIFEST_BATCH):
+            batch = [file['name'] for file in files[i:i + dac_constants.MANIFEST_BATCH]]
+            variables = {'project': project.path_with_namespace, 'ref': project.default_branch, 'paths': batch}
+            res = self.GL.session.post(self.GRAPHQL_URL, json={'query': BLOBS_QUERY, 'variables': variables}, headers={'Authorization': f"Bearer {os.getenv('GITLAB_AUTH')}"}, verify=self.GL.ssl_verify, timeout=self.GL.timeout)
+            res.raise_for_status()
+            data = res.json()
+            if data.get('errors'):
+                raise Exception(data['errors'][0].get('message'))
+            for node in data['data']['project']['repository']['blobs']['nodes']:
+                if node['path'] in batch and node.get('rawBlob') is not None:
+                    contents[node['path']] = node['rawBlob']
+        return contents
+
     #grabs the contents from a single file
     def get_single_gitlab_manifest_contents(self, file, project):
         if file['override']:
@@ -86,62 +157,80 @@ class GLScanner:
         content = base64.b64decode(file_info['content']).decode('utf-8')
         return {'file': file['name'], 'content': content, 'override': False}
 
-    #checks a repo and finds the manifest files
+    #checks a repo (the whole tree, paged) and finds the manifest files
     def check_gitlab_repo(self, project):
         files = []
         try:
-            res = project.repository_tree()
-            if res:
-                overrides = []
-                for f in res:
-                    if f['type'] == 'blob':
-                        for module in self.FILESCANNER.MODULES['modules']:
-                            if f["path"].lower() in module['manifest_file'] or f['path'].lower() in module['lock_file'] or ('config_file' in module and f["path"].lower() == module['config_file']):
-                                if 'config_file' in module and f["path"] == module['config_file']:
-                                    if module['config_parse_func'](get_single_gitlab_manifest_contents({'name': f['path'], 'override': False}, project['id'], project['default_branch'])):
-                                        overrides = overrides + module['manifest_file'] + module['lock_file']
-                                else:
-                                    files.append({'name': f['path'], 'override': False, 'id': f['id']})
-                                    if f['path'].lower() in module['lock_file']:
-                                        for file in module['manifest_file'] + module['lock_file'][:-1]:
-                                            if not f['path'].lower() == file.lower():
-                                                overrides.append(file)             
-                                break        
-            overrides = list(set(overrides))
-            for f in files:
-                if f['name'].lower() in overrides:
-                    f['override'] = True
+            res = project.repository_tree(recursive=True, all=True, per_page=100)
+            entries = [{'path': f['path'], 'id': f['id']} for f in res if f['type'] == 'blob']
+            files = self.FILESCANNER.find_manifests(entries, lambda entry: self.get_single_gitlab_manifest_contents({'name': entry['path'], 'id': entry['id'], 'override': False}, project))
         except Exception as e:
             #print(f"Error: {e} in check_gitlab_repo")
             raise
         return files
 
-    def scan_all_projects(self):
+    #scans every project on the server
+    #with a writer, projects are streamed to it as they finish instead of being collected in memory
+    #with a checkpoint, finished projects are journaled, and anything already in it is reused instead of rescanned
+    def scan_all_projects(self, writer=None, checkpoint=None):
         results = {'projects_scanned': 0, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'projects':[]}
         starttime = time.time()
         try:
             starttime = time.time()
-            projectlist = self.GL.projects.list(order_by='id', min_access_level=10)
-            #check each project concurrently (in threads)
+            retries = []
+            #check each project concurrently (in threads), results are handled in the thread so nothing piles up in the futures
+            #projects are handed to the pool as each page of the listing comes in, with only a few queued up ahead of the workers
+            pending = threading.BoundedSemaphore(self.conc * 2)
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.conc) as executor:
-                fut = [executor.submit(self.check_single_project, project.id,) for project in projectlist]
-                for r in concurrent.futures.as_completed(fut):
-                    tmp = r.result()
-                    print(tmp['project'])
-                    results['projects'].append(tmp)
+                for project in self.list_projects():
+                    previous = checkpoint.get(f"project/{project.id}") if checkpoint else None
+                    if previous is not None:
+                        self.add_project_result(results, writer, previous)
+                    else:
+                        pending.acquire()
+                        fut = executor.submit(self.scan_project, project, results, writer, retries, checkpoint)
+                        fut.add_done_callback(lambda f: pending.release())
                     
             #error check
-            for project in results['projects']:
-                if 'errors' in project:
-                    print(f"Retrying: {project['project']}...")
-                    tmp = self.check_single_project(project['id'])
-                    index = next((index for (index, d) in enumerate(results['projects']) if d["id"] == tmp['id']), None)
-                    results['projects'][index] = tmp
+            for project in retries:
+                print(f"Retrying: {project}...")
+                self.add_project_result(results, writer, self.check_single_project(project), checkpoint)
+            self.finish_unresolved(results, writer)
             
         except Exception as e:
             print(f"Error: {e} in scan_all_projects")
         return results
 
+    #lazily lists every project we can see, a page at a time
+    #keyset pagination keeps deep pages as cheap as the first (offset pages get slower, and are capped on big servers),
+    #and simple=True only returns the basic fields (no stats, permissions or links) which is all a scan needs
+    def list_projects(self):
+        return self.GL.projects.list(pagination='keyset', order_by='id', sort='asc', per_page=100, simple=True, min_access_level=10, as_list=False)
+
+    #scans a project and hands off the result (errored projects are held back for a retry)
+    def scan_project(self, project, results, writer, retries, checkpoint=None):
+        tmp = self.check_single_project(project)
+        print(tmp['project'])
+        if 'errors' in tmp:
+            retries.append(tmp['id'])
+        else:
+            self.add_project_result(results, writer, tmp, checkpoint)
+
+    #streams a project result to the writer, or adds it to the results (and journals it, if it scanned cleanly)
+    def add_project_result(self, results, writer, project, checkpoint=None):
+        self.add_result(project, project, f"project/{project['id']}", writer, checkpoint, results['projects'].append)
+
+    #retries the lookups that failed during the scan, then writes out any streamed projects that were held back for them
+    def finish_unresolved(self, results, writer=None):
+        self.retry_results(results['projects'], writer)
+
+    #project results are streamed as they are, with their files flattened ({'file', 'vulnerable', 'sus'})
+    def get_result_files(self, result):
+        return [(file['file'], file) for file in result['files']]
+
+    def get_result_record(self, result):
+        return result
+
     #writes json output to filename
     @staticmethod
     def write_output_file(resultsfile, resultsjson, print_name=True):
@@ -165,4 +254,14 @@ class GLScanner:
             for file in project['files']:
                 v += len(file['vulnerable'])
                 s += len(file['sus'])
-        return {'projects_scanned': p, 'vulnerable': v, 'sus': s}        
\ No newline at end of file
+        return {'projects_scanned': p, 'vulnerable': v, 'sus': s}
+
+    #gets (vulnerable, sus) counts for a streamed project record
+    @staticmethod
+    def get_project_counts(project):
+        v = 0
+        s = 0
+        for file in project['files']:
+            v += len(file['vulnerable'])
+            s += len(file['sus'])
+        return (v, s)        
\ No newline at end of file
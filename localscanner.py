@@ -0,0 +1,228 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import concurrent.futures
+import multiprocessing
+import subprocess
+import time
+import os
+from basescanner import BaseScanner
+from contentscanner import Scanner
+from scanstate import ScanState
+import registryclient
+import dac_constants
+
+#the scanner in each worker process (set up by init_worker)
+WORKER = None
+
+#reads objects out of a (bare) repo through one long running git cat-file --batch, instead of a git call per file
+class GitObjects:
+
+    def __init__(self, path):
+        self.proc = subprocess.Popen(['git', '--git-dir', path, 'cat-file', '--batch'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    #returns the raw contents of an object
+    def read(self, sha):
+        self.proc.stdin.write(sha.encode() + b"\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3:
+            raise KeyError(f"{sha} missing")
+        data = self.proc.stdout.read(int(header[2]))
+        #each object is followed by a newline
+        self.proc.stdout.read(1)
+        return data
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+#scans repos straight off local disk, either checkouts ('dir') or bare mirrors read from their git objects ('mirror')
+#repos are spread over a pool of processes, so a whole instance is only limited by disk, cpu and the registries
+class LocalScanner(BaseScanner):
+
+    def __init__(self, conc=20, procs=3, incremental=False):
+        self.conc = conc
+        self.procs = procs
+        self.incremental = incremental
+        self.FILESCANNER = Scanner("./modules", "modules.json")
+        #incremental state only works for mirrors, checkouts have no blob shas to compare
+        self.STATE = ScanState() if incremental else None
+        super().__init__()
+
+    #finds the repos under root: bare repos for a mirror, or checkouts (anything with a .git) for a dir
+    #a dir with no checkouts in it is scanned as one repo
+    @staticmethod
+    def find_repos(root, kind):
+        found = False
+        for path, dirs, files in os.walk(root):
+            if kind == 'mirror':
+                isrepo = 'HEAD' in files and 'objects' in dirs and 'refs' in dirs
+            else:
+                isrepo = '.git' in dirs or '.git' in files
+            if isrepo:
+                found = True
+                #dont go looking for repos inside a repo
+                dirs[:] = []
+                yield path
+            else:
+                dirs[:] = sorted(d for d in dirs if d not in dac_constants.LOCAL_SKIP_DIRS)
+        if not found and kind == 'dir':
+            yield root
+
+    #scans every repo under root, results are streamed to writer (if given) or returned
+    #repos finished by an earlier run (in the checkpoint) are skipped
+    def scan_all_repos(self, root, kind, writer=None, checkpoint=None):
+        results = {'repos_scanned': 0, 'vulnerable': 0, 'sus': 0, 'time_elapsed': 0, 'repos': []}
+        starttime = time.time()
+        try:
+            root = os.path.abspath(root)
+            tasks = self.get_tasks(root, kind, results, writer, checkpoint)
+            #each process scans a repo at a time, repos are handed out as the walk finds them
+            with multiprocessing.Pool(self.procs, init_worker, (self.conc, self.incremental, registryclient.get_limiters())) as pool:
+                for name, res in pool.imap_unordered(scan_worker, tasks):
+                    print(name)
+                    self.add_repo_result(results, writer, name, res, checkpoint)
+            self.finish_unresolved(results, writer)
+        except Exception as e:
+            print(f"Error: {e} in scan_all_repos")
+        results['time_elapsed'] = time.time() - starttime
+        return results
+
+    #yields (root, kind, path) for each repo still to scan, adding the ones from an earlier run as it goes
+    def get_tasks(self, root, kind, results, writer, checkpoint):
+        for path in self.find_repos(root, kind):
+            previous = checkpoint.get(f"path/{self.get_repo_name(root, path)}") if checkpoint else None
+            if previous is not None:
+                self.add_repo_result(results, writer, self.get_repo_name(root, path), previous)
+            else:
+                yield (root, kind, path)
+
+    #repos are named by their path under root
+    @staticmethod
+    def get_repo_name(root, path):
+        name = os.path.relpath(path, os.path.dirname(root)).replace(os.sep, '/')
+        return name[:-len(".git")] if name.endswith(".git") else name
+
+    #streams a repo result to the writer, or adds it to the results (and journals it, if it scanned cleanly)
+    def add_repo_result(self, results, writer, name, res, checkpoint=None):
+        self.add_result(res, res, f"path/{name}", writer, checkpoint, results['repos'].append)
+
+    #retries the lookups that failed during the scan, then writes out any streamed repos that were held back for them
+    def finish_unresolved(self, results, writer=None):
+        self.retry_results(results['repos'], writer)
+
+    def get_result_files(self, result):
+        return self.get_repo_files(result)
+
+    def get_result_record(self, result):
+        return self.get_repo_record(result)
+
+    #scans a single repo, its result looks like a github repo result ({name: [files], 'errors': [...]})
+    def check_single_repo(self, root, kind, path):
+        name = self.get_repo_name(root, path)
+        jsonresult = {name: [], 'errors': []}
+        try:
+            head = ""
+            if kind == 'mirror':
+                files, scanned, head = self.check_mirror(path, jsonresult[name])
+            else:
+                files, scanned = self.check_dir(path), None
+            for file, scanresult in self.scan_files(files):
+                if 'errors' in scanresult:
+                    jsonresult['errors'].append(scanresult['errors'])
+                else:
+                    jsonresult[name].append(scanresult)
+                    if scanned is not None and 'unresolved' not in scanresult[file['file']]:
+                        scanned.append({'path': file['file'], 'sha': file['sha'], 'override': file['override'], 'result': scanresult})
+            if len(jsonresult['errors']) == 0:
+                del jsonresult['errors']
+                if self.STATE and scanned is not None:
+                    self.STATE.put_repo(f"mirror/{path}", head, jsonresult[name], scanned)
+        except Exception as e:
+            print(f"{name} : Error: {e} in check_single_repo")
+        return jsonresult
+
+    #scans a batch of manifests (already read) concurrently, yielding (file, scanresult) as each finishes
+    def scan_files(self, files):
+        if not files:
+            return
+        context = self.FILESCANNER.get_repo_context(files)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.conc) as executor:
+            futs = {executor.submit(self.FILESCANNER.scan_contents, file['file'], file['content'], file['override'], context): file for file in files}
+            for fut in concurrent.futures.as_completed(futs):
+                yield futs[fut], fut.result()
+
+    #finds and reads the manifests in a checkout, skipping dependency folders (node_modules etc.)
+    def check_dir(self, path):
+        entries = []
+        for directory, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if d not in dac_constants.LOCAL_SKIP_DIRS]
+            for file in files:
+                entries.append({'path': os.path.relpath(os.path.join(directory, file), path).replace(os.sep, '/')})
+        files = self.FILESCANNER.find_manifests(entries, lambda entry: {'file': entry['path'], 'content': self.read_file(path, entry['path'])})
+        return [{'file': file['name'], 'content': '' if file['override'] else self.read_file(path, file['name']), 'override': file['override']} for file in files]
+
+    @staticmethod
+    def read_file(path, name):
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            return f.read()
+
+    #finds and reads the manifests at HEAD in a bare repo, straight from its git objects
+    #in incremental mode, results still good from the last scan are added to results and returned as scanned, the rest are read
+    #returns (files to scan, scanned, head sha)
+    def check_mirror(self, path, results):
+        head = subprocess.run(['git', '--git-dir', path, 'rev-parse', '--verify', '-q', 'HEAD^{commit}'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if head.returncode != 0:
+            #empty repo
+            return [], [], ""
+        head = head.stdout.decode().strip()
+        if self.STATE:
+            previous = self.STATE.get_repo(f"mirror/{path}", head)
+            if previous is not None:
+                results += previous
+                return [], None, head
+
+        tree = subprocess.run(['git', '--git-dir', path, 'ls-tree', '-r', '-z', '--full-tree', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        entries = []
+        for line in tree.stdout.decode("utf-8", "replace").split("\0"):
+            if not line:
+                continue
+            info, name = line.split("\t", 1)
+            mode, kind, sha = info.split()
+            if kind == 'blob':
+                entries.append({'path': name, 'sha': sha})
+        objects = GitObjects(path)
+        try:
+            files = self.FILESCANNER.find_manifests(entries, lambda entry: {'file': entry['path'], 'content': objects.read(entry['sha']).decode("utf-8")})
+            scanned, files = self.FILESCANNER.split_manifests(self.STATE, f"mirror/{path}", files)
+            results += [row['result'] for row in scanned]
+            todo = [{'file': file['name'], 'sha': file['sha'], 'content': '' if file['override'] else objects.read(file['sha']).decode("utf-8"), 'override': file['override']} for file in files]
+        finally:
+            objects.close()
+        return todo, scanned, head
+
+    #get recap info for the dacutil.py file
+    @staticmethod
+    def get_recap(results):
+        v = 0
+        s = 0
+        for repo in results['repos']:
+            vulns, sus = LocalScanner.get_repo_counts(LocalScanner.get_repo_record(repo))
+            v += vulns
+            s += sus
+        return {'repos_scanned': len(results['repos']), 'vulnerable': v, 'sus': s}
+
+#sets up the scanner for a worker process (registry lookups are paced against the same per-host budgets as every other worker)
+def init_worker(conc, incremental, registry_limiters):
+    global WORKER
+    registryclient.set_limiters(registry_limiters)
+    WORKER = LocalScanner(conc, 1, incremental)
+
+#scans one repo in a worker process, returns (name, result)
+def scan_worker(task):
+    root, kind, path = task
+    return WORKER.get_repo_name(root, path), WORKER.check_single_repo(root, kind, path)
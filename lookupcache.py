@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import time
+import sqlite3
+import threading
+import collections
+import dac_constants
+
+NOT_FOUND = '0.0.0.0'
+#a lookup that failed (timeout, 5xx, ...), never cached
+ERROR = 'error'
+#bumped whenever rows written by older versions cant be trusted, they are dropped when the cache is opened
+#(1: older versions also stored versions taken from lockfiles, not the registry, as found)
+CACHE_VERSION = 1
+
+#persistent (sqlite) cache of public registry lookups, shared between runs and processes
+class LookupCache:
+
+    def __init__(self, path=None, ttls=None):
+        self.path = dac_constants.CACHE_FILE if path is None else path
+        self.ttls = dac_constants.CACHE_TTLS if ttls is None else ttls
+        self.local = threading.local()
+
+    #an empty path turns the cache off
+    def enabled(self):
+        return bool(self.path)
+
+    #sqlite connections cant be shared across threads or forks, so each thread in each process gets its own
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            #WAL lets many readers work alongside a single writer (across processes too)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS lookups (registry TEXT NOT NULL, coords TEXT NOT NULL, version TEXT, found INTEGER NOT NULL, checked REAL NOT NULL, PRIMARY KEY (registry, coords))")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] < CACHE_VERSION:
+                    conn.execute("DELETE FROM lookups")
+                    conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    #gets the ttl (in seconds) for a found/not found answer from a registry
+    def get_ttl(self, registry, found):
+        ttls = self.ttls.get(registry, self.ttls['default'])
+        return ttls['found'] if found else ttls['not_found']
+
+    #returns the cached version for a package, or None if it isnt cached (or has expired)
+    def get(self, registry, coords):
+        if not self.enabled():
+            return None
+        try:
+            row = self.get_connection().execute("SELECT version, found, checked FROM lookups WHERE registry = ? AND coords = ?", (registry, coords)).fetchone()
+            if row is None:
+                return None
+            version, found, checked = row
+            if time.time() - checked > self.get_ttl(registry, found):
+                return None
+            return version
+        except Exception as e:
+            print(f"Error: {e} in LookupCache.get")
+            return None
+
+    #stores the result of a registry lookup
+    #only answers that actually came from the registry belong here (never failed lookups, or versions taken from a lockfile)
+    def put(self, registry, coords, version):
+        if not self.enabled():
+            return
+        try:
+            found = 0 if version == NOT_FOUND else 1
+            self.get_connection().execute("INSERT OR REPLACE INTO lookups (registry, coords, version, found, checked) VALUES (?, ?, ?, ?, ?)", (registry, coords, str(version), found, time.time()))
+        except Exception as e:
+            print(f"Error: {e} in LookupCache.put")
+
+    #returns every cached row for a package name (across registries)
+    def lookup(self, coords, registry=None):
+        query = "SELECT registry, coords, version, found, checked FROM lookups WHERE coords = ?"
+        args = [coords]
+        if registry:
+            query += " AND registry = ?"
+            args.append(registry)
+        rows = self.get_connection().execute(query, args).fetchall()
+        return [{'registry': r[0], 'coords': r[1], 'version': r[2], 'found': bool(r[3]), 'checked': r[4], 'expired': time.time() - r[4] > self.get_ttl(r[0], r[3])} for r in rows]
+
+    #returns per registry counts of found/not found/expired entries
+    def stats(self):
+        results = {}
+        now = time.time()
+        rows = self.get_connection().execute("SELECT registry, found, checked FROM lookups").fetchall()
+        for registry, found, checked in rows:
+            tmp = results.setdefault(registry, {'found': 0, 'not_found': 0, 'expired': 0})
+            tmp['found' if found else 'not_found'] += 1
+            if now - checked > self.get_ttl(registry, found):
+                tmp['expired'] += 1
+        return results
+
+    #deletes expired entries (or everything, if expired_only is False), returns the number removed
+    def prune(self, registry=None, expired_only=True):
+        conn = self.get_connection()
+        registries = [registry] if registry else [r[0] for r in conn.execute("SELECT DISTINCT registry FROM lookups").fetchall()]
+        removed = 0
+        now = time.time()
+        for reg in registries:
+            if expired_only:
+                cur = conn.execute("DELETE FROM lookups WHERE registry = ? AND ((found = 1 AND checked < ?) OR (found = 0 AND checked < ?))", (reg, now - self.get_ttl(reg, True), now - self.get_ttl(reg, False)))
+            else:
+                cur = conn.execute("DELETE FROM lookups WHERE registry = ?", (reg,))
+            removed += cur.rowcount
+        conn.execute("VACUUM")
+        return removed
+
+    #turns a package dict into the coordinates we key on, using only the fields the module says matter
+    @staticmethod
+    def get_coords(pkg, fields=('group', 'name')):
+        return ':'.join(str(pkg[field]) for field in fields if pkg.get(field))
+
+    #turns coordinates back into a package dict (missing fields are the leading ones, e.g. a maven name with no group)
+    @staticmethod
+    def get_package(coords, fields=('group', 'name')):
+        parts = coords.split(':')
+        return dict(zip(fields[len(fields) - len(parts):], parts))
+
+#bounded in-memory LRU cache (with a ttl) for lookups made during a single run
+class MemoryCache:
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = dac_constants.MEMORY_CACHE_SIZE if max_size is None else max_size
+        self.ttl = dac_constants.MEMORY_CACHE_TTL if ttl is None else ttl
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    #returns the cached value for key, or None if it isnt cached (or has expired)
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and time.time() - item[1] <= self.ttl:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self.data[key]
+            self.misses += 1
+            return None
+
+    #stores a value, evicting the least recently used entries if we are full
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.time())
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    #hit/miss/eviction counters for the end of run recap
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.data), 'max_size': self.max_size}
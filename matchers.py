@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import re
+import fnmatch
+
+GLOB_CHARS = ('*', '?', '[')
+
+#ignore list index, precompiled once so filtering a dependency doesnt scan the whole list
+#plain names go in a frozenset, 'prefix*' style patterns (e.g. @types/*) are prefix matched and anything else is a glob
+class IgnoreIndex:
+
+    def __init__(self, patterns):
+        exact = set()
+        prefixes = set()
+        globs = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            if not any(x in pattern for x in GLOB_CHARS):
+                exact.add(pattern)
+            elif pattern.endswith('*') and not any(x in pattern[:-1] for x in GLOB_CHARS):
+                prefixes.add(pattern[:-1])
+            else:
+                globs.append(fnmatch.translate(pattern))
+        self.exact = frozenset(exact)
+        self.prefixes = tuple(sorted(prefixes))
+        self.glob = re.compile('|'.join(globs)) if globs else None
+
+    #returns True if name should be ignored
+    def matches(self, name):
+        if name in self.exact:
+            return True
+        if self.prefixes and name.startswith(self.prefixes):
+            return True
+        return self.glob is not None and self.glob.match(name) is not None
+
+#matches text against a whole keyword list with one compiled regex
+#keywords are substrings by default, or can be given a mode: 'prefix:foo', 'exact:foo', 're:foo.*bar' (or 'substring:foo')
+class KeywordMatcher:
+
+    def __init__(self, keywords):
+        self.keywords = [x.strip() for x in keywords if x and x.strip()]
+        parts = []
+        for keyword in self.keywords:
+            mode, sep, value = keyword.partition(':')
+            if not sep or mode not in ('substring', 'prefix', 'exact', 're'):
+                mode, value = 'substring', keyword
+            if mode == 'substring':
+                parts.append(re.escape(value))
+            elif mode == 'prefix':
+                parts.append('^' + re.escape(value))
+            elif mode == 'exact':
+                parts.append('^' + re.escape(value) + r'\Z')
+            else:
+                parts.append(value)
+        self.regex = re.compile('|'.join(f"(?:{x})" for x in parts)) if parts else None
+
+    #returns True if any keyword matches text
+    def matches(self, text):
+        if self.regex is None or not text:
+            return False
+        return self.regex.search(text) is not None
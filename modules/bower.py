@@ -6,7 +6,7 @@
 #
 ###
 #Checks bower.json files for potential and active dependency confusion attacks###
-import urllib
+import registryclient
 import json
 import re
 
@@ -31,12 +31,9 @@ def get_bower_dependencies(filename, json_file):
 #checks the npm public repo for a package
 def check_bower_public_repo(pkg):
     try:
-        with urllib.request.urlopen(f"https://registry.npmjs.org/{pkg['name']}/", timeout=10) as url:
-            data = json.loads(url.read().decode())
-        if "dist-tags" in data:
-            return data['dist-tags']['latest']
-        else:
-            return data['time']['unpublished']['versions'][0]
+        return registryclient.get_npm_latest("https://registry.npmjs.org", pkg['name'], timeout=10)
     except Exception as e:
         #print(f"Bower Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
@@ -7,7 +7,7 @@
 ###
 #Checks cocoapods files for potential and active dependency confusion attacks
 ###
-import requests
+import registryclient
 import json
 import re
 import yaml
@@ -26,7 +26,7 @@ def get_cocoapods_dependencies(filename, contents):
                 sources.append(match.group(1))
             external = False
             for source in sources:
-                if not any(x in source for x in dac_constants.INTERNAL_KEYWORDS):
+                if not dac_constants.INTERNAL_MATCHER.matches(source):
                     external = True
                     break
             if not external:
@@ -60,7 +60,7 @@ def get_cocoapods_dependencies(filename, contents):
         #disregard any dependencies that point to internal git repos
         results = []
         for dep in result:
-            if not any(substring in dep['version'] for substring in dac_constants.INTERNAL_KEYWORDS):
+            if not dac_constants.INTERNAL_MATCHER.matches(dep['version']):
                 results.append(dep)
                 
     except Exception as e:
@@ -71,13 +71,15 @@ def get_cocoapods_dependencies(filename, contents):
 #checks the cocoapods public repo for a package
 def check_cocoapods_public_repo(pkg):
     try:
-        data = '{"params":"query=' + pkg['name'] + '"}'
-        ret = requests.post("https://wbhhamhynm-dsn.algolia.net/1/indexes/cocoapods/query?x-algolia-application-id=WBHHAMHYNM&x-algolia-api-key=4f7544ca8701f9bf2a4e55daff1b09e9", data, timeout=5)
-        data = ret.json()
+        #we only ever look at the top hit, so only ask for that
+        data = '{"params":"query=' + pkg['name'] + '&hitsPerPage=1&attributesToRetrieve=name,version"}'
+        data = registryclient.post_json("https://wbhhamhynm-dsn.algolia.net/1/indexes/cocoapods/query?x-algolia-application-id=WBHHAMHYNM&x-algolia-api-key=4f7544ca8701f9bf2a4e55daff1b09e9", data, timeout=5)
         if data['hits']:
             if data['hits'][0]['name'] == pkg['name']:
                 return data['hits'][0]['version']
         return '0.0.0.0'  
     except Exception as e:
         #print(f"cocoapods Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
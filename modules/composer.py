@@ -8,11 +8,13 @@
 #Checks composer files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
+import registryclient
 import json
 import re
 from urllib.parse import urlparse
 
+VERSION = re.compile(rb'"version"\s*:\s*"([^"]*)"')
+
 #grabs actual dependencies from a composer file
 def get_composer_dependencies(filename, contents):
     results = []
@@ -30,7 +32,7 @@ def get_composer_dependencies(filename, contents):
                     version = dep['version']
                     url = dep['source']['url']
                     domain = urlparse(url).netloc
-                    if any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
+                    if dac_constants.INTERNAL_MATCHER.matches(domain):
                         continue                    
                     results.append({'name': name, 'version': version, 'url': url})
     except Exception as e:
@@ -41,15 +43,13 @@ def get_composer_dependencies(filename, contents):
 #checks the composer public repo for a package
 def check_composer_public_repo(pkg):
     try:
-        if 'url' in pkg:
-            return pkg['version']
-        with urllib.request.urlopen(f"https://repo.packagist.org/p2/{pkg['name']}.json", timeout=10) as url:
-            data = json.loads(url.read().decode())
-        if 'packages' in data:
-            if pkg['name'] in data['packages']:
-                if len(data['packages'][pkg['name']]) > 0:
-                    return data['packages'][pkg['name']][0]['version']
-        return '0.0.0.0'    
+        #the newest release comes first, so stop reading as soon as we see a version
+        match = registryclient.search_stream(f"https://repo.packagist.org/p2/{pkg['name']}.json", VERSION, timeout=10)
+        if match:
+            return match.group(1).decode()
+        return '0.0.0.0'
     except Exception as e:
         #print(f"composer Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
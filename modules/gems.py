@@ -8,7 +8,7 @@
 #Checks GEMS files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
+import registryclient
 import re
 import json
 import collections
@@ -67,7 +67,7 @@ class LockParser():
         remoteserver = re.search(REMOTE, block)
         if remoteserver is not None:
             remoteserver = remoteserver.group(1)
-            if any(x in remoteserver for x in dac_constants.INTERNAL_KEYWORDS):
+            if dac_constants.INTERNAL_MATCHER.matches(remoteserver):
                 return {'server': remoteserver, 'internal': True}
             else:
                 return {'server': remoteserver, 'internal': False}
@@ -113,7 +113,7 @@ def get_gems_dependencies(filename, contents):
                 sources.append(match.group(1))
             external = False
             for source in sources:
-                if not any(x in source for x in dac_constants.INTERNAL_KEYWORDS):
+                if not dac_constants.INTERNAL_MATCHER.matches(source):
                     external = True
                     break
             if not external:
@@ -143,9 +143,13 @@ def get_gems_dependencies(filename, contents):
 #checks the gems public repo for a package
 def check_gems_public_repo(pkg):
     try:
-        with urllib.request.urlopen(f"https://rubygems.org/api/v1/gems/{pkg['name']}.json", timeout=10) as url:
-            data = json.loads(url.read().decode())
+        #the latest version endpoint is tiny compared to the full gem info
+        data = registryclient.get_json(f"https://rubygems.org/api/v1/versions/{pkg['name']}/latest.json", timeout=10)
+        if data['version'] == "unknown":
+            return '0.0.0.0'
         return data['version']
     except Exception as e:
         #print(f"GEMS Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
@@ -8,178 +8,249 @@
 #Checks gradle files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
-import json
+import registryclient
 import re
-from ratelimit import limits, sleep_and_retry
+import toml
 from urllib.parse import urlparse
 
+#one pass tokenizer for build scripts (groovy and kotlin dsl): comments, strings (kept whole, so braces and quotes
+#inside them dont count), braces, brackets/parens and statement ends (newlines outside of parens, or ;)
+TOKENS = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+   |(?P<string>\"\"\".*?(?:\"\"\"|\Z)|'''.*?(?:'''|\Z)|"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)
+   |(?P<open>\{)
+   |(?P<close>\})
+   |(?P<paren>[()\[\]])
+   |(?P<end>[\n;])
+   |(?P<text>[^/"'{}()\[\]\n;]+|/)
+""", re.S | re.X)
+#a statement ending in one of these carries on onto the next line
+CONTINUATIONS = (',', '+', '=', ':', '&&', '||', '?')
+STRING = re.compile(r""""(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'""")
+#+ outside of strings
+PLUS = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|\+""")
+#$name, ${name} or ${rootProject.ext.name} inside a string
+INTERPOLATION = re.compile(r"\$\{\s*([\w.]+)\s*\}|\$(\w+)")
+#def x = ..., val x = ..., var x: String = ..., ext.x = ..., project.ext.x = ..., extra["x"] = ..., ext['x'] = ...
+ASSIGNMENT = re.compile(r"""^(?:(?:def|val|var|const\s+val|String)\s+(\w+)(?:\s*:\s*[\w.?<>]+)?|(?:(?:root)?[pP]roject\.)?ext\.(\w+)|(?:ext|extra)\[\s*["'](\w+)["']\s*\])\s*=\s*(.+)$""", re.S)
+#ext.set("x", ...) and val x by extra(...)
+EXT_SET = re.compile(r"""^(?:(?:root)?[pP]roject\.)?(?:ext\.|extra\.)?set\(\s*["'](\w+)["']\s*,\s*(.+)\)$""", re.S)
+EXTRA_DELEGATE = re.compile(r"""^val\s+(\w+)\s+by\s+extra\((.+)\)$""", re.S)
+#an assignment inside an ext { } block
+EXT_ASSIGNMENT = re.compile(r"^(\w+)\s*=\s*(.+)$", re.S)
+CONCAT = re.compile(r"""^([\w.]+)\.concat\(\s*("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')\s*\)$""")
+#a dependency: configuration 'notation' or configuration("notation") (with or without named arguments)
+DEPENDENCY = re.compile(r"^(\w+)\s*(?:\((.*)\)|\s(.*))$", re.S)
+NAMED_ARGUMENT = re.compile(r"""\b(group|name|version)\s*[:=]\s*("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[\w.]+)""")
+#dependencies on other projects, local files or the gradle/kotlin distribution, none of which come from a repo we can check
+LOCAL_DEPENDENCIES = re.compile(r"\b(?:project|files|fileTree|gradleApi|localGroovy|gradleTestKit|kotlin)\s*\(")
+#platform("g:a:v"), enforcedPlatform(...) and testFixtures(...) just wrap a normal notation
+WRAPPERS = re.compile(r"^(?:platform|enforcedPlatform|testFixtures)\s*\((.*)\)$", re.S)
+#url = repoUrl, url repoUrl or setUrl(repoUrl)
+REPO_VARIABLE = re.compile(r"^(?:url\s*=?\s*|setUrl\(\s*)(?:uri\(\s*)?([\w.]+)\s*\)*$")
+
+#parses a build.gradle or build.gradle.kts
+#the file is tokenized once into statements and blocks, which are then walked once, in order, with def/val/ext variables
+#kept in a dict as they are defined, so parsing is linear in the size of the file no matter how many variables it has
 class GradleSlurper:
     def __init__(self, source):
         self.source = source
-        fixed = re.sub(re.compile(r"\n^\s*$\n", re.DOTALL|re.MULTILINE), "\n", self.source)
-        self.lines = fixed.split("\n")
-        self.indent = 0
-        self.defs = self.get_defs()
-        self.data = self.parse()
-        self.repositories = self.get_repos()
-        self.dependencies = self.get_dependencies()
+        self.vars = {}
+        self.repositories = []
+        self.dependencies = []
+        self.walk(self.tokenize(source), [])
+        self.repositories = list(set(self.repositories))
 
-    def get_block(self):
-        line = self.lines.pop(0)
-        result = re.search(r"^(?:\s*)(.*?)(?:\s*\{\s*)$", line)
-        results = {result.group(1): []}
-        blockindent = self.get_indent(self.lines[0])
-        blocklines = []
-        while self.lines and self.get_indent(self.lines[0]) == blockindent:
-            line = self.lines[0]
-            if self.is_block(line):
-                blocklines.append(self.get_block())
+    #splits the file into a list of statements (strings) and blocks ((header, [statements and blocks]))
+    @staticmethod
+    def tokenize(source):
+        root = []
+        stack = [root]
+        current = []
+        depth = 0
+        for match in TOKENS.finditer(source):
+            kind = match.lastgroup
+            text = match.group()
+            if kind == 'comment':
+                continue
+            if kind == 'paren':
+                depth = max(depth + (1 if text in '([' else -1), 0)
+                current.append(text)
+            elif kind == 'open' and depth == 0:
+                block = (''.join(current).strip(), [])
+                stack[-1].append(block)
+                stack.append(block[1])
+                current = []
+            elif kind == 'close' and depth == 0:
+                statement = ''.join(current).strip()
+                if statement:
+                    stack[-1].append(statement)
+                if len(stack) > 1:
+                    stack.pop()
+                current = []
+            elif kind == 'end' and depth == 0:
+                statement = ''.join(current).strip()
+                if statement.endswith(CONTINUATIONS):
+                    current.append(' ')
+                else:
+                    if statement:
+                        stack[-1].append(statement)
+                    current = []
             else:
-                tmp = self.lines.pop(0).strip()
-                if not tmp == "}" and not tmp.startswith("//"):
-                    blocklines.append(tmp)
-        results[result.group(1)] = blocklines
-        return results
+                current.append(' ' if kind == 'end' else text)
+        statement = ''.join(current).strip()
+        if statement:
+            stack[-1].append(statement)
+        return root
 
-    def get_indent(self, line):
-        indent = re.search(r"^(\s*)", line)
-        if not indent:
-            return 0
-        return len(indent.group(0))
+    #goes through the statements and blocks in order, path is the names of the blocks we are in
+    def walk(self, items, path):
+        for item in items:
+            if isinstance(item, tuple):
+                header, children = item
+                if path and path[-1] == 'dependencies' and DEPENDENCY.match(header):
+                    #implementation('g:a:v') { exclude ... }
+                    self.add_dependency(header)
+                    continue
+                if path and path[0] == 'repositories':
+                    self.add_repo(header)
+                self.walk(children, path + [header.split('(')[0].strip()])
+            elif not self.add_variable(item, path):
+                if path and path[-1] == 'dependencies':
+                    self.add_dependency(item)
+                elif path and path[0] == 'repositories':
+                    self.add_repo(item)
 
-    def is_block(self, line):
-        if not re.search(r"(\s*\{\s*)$", line):
-            return False
-        else:
+    #remembers a variable if the statement defines one, returns True if it did
+    def add_variable(self, statement, path):
+        match = ASSIGNMENT.match(statement)
+        if match:
+            self.vars[match.group(1) or match.group(2) or match.group(3)] = self.evaluate(match.group(4))
             return True
-        
-    def parse(self):
-        results = {}
-        while True:
-            if len(self.lines) == 0:
-                break
-            line = self.lines[0]
-            self.indent = self.get_indent(line)
-            if self.is_block(line):
-                results = {**results, **self.get_block()}
-            else:
-                tmp = self.lines.pop(0).strip()
-                if not tmp == "}":
-                    #results.append(tmp)
-                    pass
-        return results
-    
-    def get_repo(self, repo):
-        repo = self.replace_def(repo)
-        result = re.search(r"['\"]((?:http|/).*?)['\"]", repo)
-        if result:
-            return result.group(1)
-        else:
-            return None
-        
-    def get_repos(self):
-        results = []
-        if 'repositories' in self.data:
-            for repo in self.data['repositories']:
-                if isinstance(repo, str):
-                    result = self.get_repo(repo)
-                    if result:
-                        results.append(result)
-                else:
-                    block = next(iter(repo))
-                    for item in repo[block]:
-                        if isinstance(item, str):
-                            result = self.get_repo(item)
-                            if result:
-                                results.append(result)
-        results = list(set(results))
-        return results
+        match = EXT_SET.match(statement) or EXTRA_DELEGATE.match(statement)
+        if not match and path and path[-1] in ('ext', 'extra.apply', 'extra'):
+            match = EXT_ASSIGNMENT.match(statement)
+        if match:
+            self.vars[match.group(1)] = self.evaluate(match.group(2))
+            return True
+        return False
 
-    def get_dependencies(self):
-        results = self.get_deps(self.data)
-        for block in self.data:
-            for item in self.data[block]:
-                if isinstance(item, dict):
-                    results = results + self.get_deps(item)   
-        return results
+    #works out the value of an expression, as far as strings, variables, + and concat go (None if it cant)
+    def evaluate(self, expr):
+        expr = expr.strip()
+        #default values (x ?: 'default'), we take the default
+        if '?:' in expr:
+            expr = expr.rsplit('?:', 1)[1].strip()
+        if expr.startswith('uri(') and expr.endswith(')'):
+            expr = expr[4:-1].strip()
+        parts = []
+        start = 0
+        for match in PLUS.finditer(expr + '+'):
+            if match.group(1) is None:
+                parts.append(expr[start:match.start()].strip())
+                start = match.end()
+        values = []
+        for part in parts:
+            if STRING.fullmatch(part):
+                values.append(self.interpolate(part[1:-1]))
+                continue
+            concat = CONCAT.match(part)
+            value = self.lookup(concat.group(1) if concat else part)
+            if value is None:
+                return None
+            values.append(value + self.interpolate(concat.group(2)[1:-1]) if concat else value)
+        return ''.join(values)
 
-    def get_deps(self, data):
-        results = []
-        if 'dependencies' in data:
-            for dep in data['dependencies']:
-                if isinstance(dep, dict):
-                    dep = next(iter(dep))
-                dep = re.sub(r"(classpath |testCompile |compile |implementation |testImplementation |extraLibs |runtime )", "", dep).strip()
-                if 'name:' not in dep:
-                #it was set up like 'group:package:version'
-                    if dep.startswith("'") or dep.startswith('"'):
-                        i = re.sub("[\,'\"]", "", dep).strip().split(':')
-                        if len(i) == 3:
-                            #if there is a name, a groupid, and a non-snapshot, non-range version, then it isnt vulnerable
-                            #otherwise, we add it to be checked
-                            i[2] = self.replace_def(i[2])
-                            if ',' in i[2] or 'SNAPSHOT' in i[2]:
-                                results.append({'name': i[1], 'version': i[2], 'group': i[0]})
-                        elif len(i) == 2:
-                            results.append({'name': i[1], 'version': 'TBD', 'group': i[0]})
-                else:
-                    if dep.startswith("group"):
-                        dep = re.sub(r"//.*", "", dep)
-                        r = re.search('name:\s*[\'"](.*?)[\'"]()', dep)
-                        name = r.group(1) if r else None
-                        r = re.search('group:\s*[\'"](.*?)[\'"]()', dep)
-                        group = r.group(1) if r else None
-                        r = re.search('version:\s*[\'"](.*?)[\'"]()', dep)
-                        version = r.group(1) if r else None
-                        if name:
-                            if group:
-                                if version:
-                                    if ',' in version or 'SNAPSHOT' in version:
-                                        results.append({'name': name, 'version': version, 'group': group})
-                                else:
-                                    results.append({'name': name, 'version': '0.0.0.0', 'group': group})
-                            else:
-                                if version:
-                                    results.append({'name': name, 'version': version})
-                                else:
-                                    results.append({'name': name, 'version': '0.0.0.0'})   
-        return results
+    #gets a variable by name, or by the last part of a qualified name (rootProject.ext.x, project.x)
+    def lookup(self, name):
+        if name in self.vars:
+            return self.vars[name]
+        return self.vars.get(name.rsplit('.', 1)[-1])
 
-    def get_defs(self):
-        deflist = []
-        results = []
-        for line in self.lines:
-            if line.startswith("def "):
-                deflist.append(line[4:])
-        for adef in deflist:
-            adef = adef.split(' = ')
-            if len(adef) == 2:
-                if not adef[1].startswith("[") and not adef[1].startswith("{"):
-                    if " ?: " in adef[1]:
-                        adef[1] = adef[1].split(" ?: ")[1]            
-                    adef[1] = adef[1][1:-1]
-                    results.append({'name': adef[0], 'value': adef[1]})
-        return results
+    #fills in $x and ${x} from the variables we know (unknown ones are left alone)
+    def interpolate(self, text):
+        if '$' not in text:
+            return text
+        def replace(match):
+            value = self.lookup(match.group(1) or match.group(2))
+            return match.group() if value is None else value
+        return INTERPOLATION.sub(replace, text)
 
-    def replace_def(self, text):
-        result = ""
-        if text.startswith('$'):
-            for adef in self.defs:
-                text = text.replace(f"${adef['name']}", adef['value'])
-        else:
-            for adef in self.defs:
-                pat = f"{adef['name']}.concat\(['\"]"
-                pat = re.compile(pat)
-                text = re.sub(pat, '"' + adef['value'], text)
-        return text
+    #picks repo urls out of a statement in the repositories block
+    def add_repo(self, statement):
+        for literal in STRING.findall(statement):
+            url = self.interpolate(literal[1:-1])
+            if url.startswith(('http', '/')):
+                self.repositories.append(url)
+        match = REPO_VARIABLE.match(statement)
+        if match and (self.lookup(match.group(1)) or "").startswith(('http', '/')):
+            self.repositories.append(self.lookup(match.group(1)))
+
+    #parses a dependency statement (string, named argument and variable notations)
+    def add_dependency(self, statement):
+        match = DEPENDENCY.match(statement)
+        if not match:
+            return
+        notation = (match.group(2) if match.group(2) is not None else match.group(3)).strip()
+        if LOCAL_DEPENDENCIES.search(notation):
+            return
+        wrapped = WRAPPERS.match(notation)
+        if wrapped:
+            notation = wrapped.group(1).strip()
+        named = {k: self.evaluate(v) for k, v in NAMED_ARGUMENT.findall(notation)}
+        if named.get('name'):
+            self.add_package(named.get('group'), named['name'], named.get('version'))
+            return
+        #'group:name:version' (or a variable holding one), libs.x references are covered by scanning the version catalog
+        literal = STRING.match(notation)
+        value = self.interpolate(literal.group()[1:-1]) if literal else self.evaluate(notation.split(',')[0])
+        if value and value.count(':') >= 1:
+            i = value.split(':')
+            self.add_package(i[0], i[1], i[2] if len(i) > 2 and i[2] else None)
+
+    #if there is a name, a groupid, and a non-snapshot, non-range version, then it isnt vulnerable
+    #otherwise, we add it to be checked
+    def add_package(self, group, name, version):
+        if group and version and ',' not in version and 'SNAPSHOT' not in version:
+            return
+        package = {'name': name, 'version': version or 'TBD'}
+        if group:
+            package['group'] = group
+        self.dependencies.append(package)
 
-#grabs actual dependencies from a gradle.build file
+#grabs the libraries from a version catalog (gradle/libs.versions.toml)
+#versions can be given inline, as version.ref pointing at [versions], or as rich versions ({strictly/require/prefer})
+def get_catalog_dependencies(contents):
+    catalog = toml.loads(contents)
+    versions = catalog.get('versions', {})
+    results = []
+    for library in catalog.get('libraries', {}).values():
+        if isinstance(library, str):
+            i = library.split(':')
+            library = {'group': i[0], 'name': i[1] if len(i) > 1 else None, 'version': i[2] if len(i) > 2 else None}
+        elif 'module' in library:
+            library = {**library, 'group': library['module'].split(':')[0], 'name': library['module'].split(':')[-1]}
+        version = library.get('version')
+        if isinstance(version, dict) and 'ref' in version:
+            version = versions.get(version['ref'])
+        if isinstance(version, dict):
+            version = version.get('strictly') or version.get('require') or version.get('prefer')
+        group = library.get('group')
+        if not library.get('name'):
+            continue
+        #if there is a name, a groupid, and a non-snapshot, non-range version, then it isnt vulnerable
+        #otherwise, we add it to be checked
+        if group and version and ',' not in version and 'SNAPSHOT' not in version:
+            continue
+        results.append({'name': library['name'], 'version': version or 'TBD', 'group': group})
+    return results
+
+#grabs actual dependencies from a build.gradle(.kts), gradle.lockfile or version catalog
 def get_gradle_dependencies(filename, contents):
     results = []
     try:
         if filename.lower() == "gradle.lockfile":
-            lines = contents.splilt("\n")
+            lines = contents.split("\n")
             lines[:] = [x for x in lines if not x.startswith('#')]
             for line in lines:
                 line = line.split("=")[0]
@@ -189,6 +260,8 @@ def get_gradle_dependencies(filename, contents):
                     version = items[2]
                     group = items[0]
                     results.append({'name': name, 'version': version, 'group': group})
+        elif filename.lower().endswith(".versions.toml"):
+            results = get_catalog_dependencies(contents)
         else:
             gradleresults = GradleSlurper(contents)
             
@@ -196,7 +269,7 @@ def get_gradle_dependencies(filename, contents):
                 internal = True
                 for match in gradleresults.repositories:
                     domain = urlparse(match).netloc
-                    if not any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
+                    if not dac_constants.INTERNAL_MATCHER.matches(domain):
                         internal = False
                         break
                 if internal:
@@ -209,8 +282,6 @@ def get_gradle_dependencies(filename, contents):
         raise
     return results
 
-@sleep_and_retry
-@limits(calls=10, period=1)
 #checks the maven public repo for a package
 def check_gradle_public_repo(pkg):
     try:
@@ -218,14 +289,15 @@ def check_gradle_public_repo(pkg):
             qs = f"a:%22{pkg['name']}%22%20AND%20g%3A%22{pkg['group']}%22"
         else:
             qs = f"a:%22{pkg['name']}%22"
-        mavenurl = f"https://search.maven.org/solrsearch/select?q={qs}"
+        mavenurl = f"https://search.maven.org/solrsearch/select?q={qs}&rows=1&wt=json"
         
-        with urllib.request.urlopen(mavenurl, timeout=10) as url:
-            data = json.loads(url.read().decode())     
-            if data['response']['numFound'] == 0:
-                return '0.0.0.0'
-            else:
-                return data['response']['docs'][0]['latestVersion']
+        data = registryclient.get_json(mavenurl, timeout=10)
+        if data['response']['numFound'] == 0:
+            return '0.0.0.0'
+        else:
+            return data['response']['docs'][0]['latestVersion']
     except Exception as e:
         #print(f"Maven Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
@@ -7,8 +7,7 @@
 ###
 #Checks GULP files for potential and active dependency confusion attacks
 ###
-import urllib
-import json
+import registryclient
 import re
 
 #grabs actual dependencies from a gulpfile.js file
@@ -30,12 +29,9 @@ def get_gulp_dependencies(filename, contents):
 #checks the npm public repo for a package
 def check_gulp_public_repo(pkg):
     try:
-        with urllib.request.urlopen(f"https://registry.npmjs.org/{pkg['name']}/", timeout=10) as url:
-            data = json.loads(url.read().decode())
-        if "dist-tags" in data:
-            return data['dist-tags']['latest']
-        else:
-            return data['time']['unpublished']['versions'][0]
+        return registryclient.get_npm_latest("https://registry.npmjs.org", pkg['name'], timeout=10)
     except Exception as e:
         #print(f"gulp Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
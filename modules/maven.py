@@ -8,59 +8,162 @@
 #Checks maven files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
+import registryclient
 from lxml import etree as ElementTree
-from ratelimit import limits, sleep_and_retry
 from urllib.parse import urlparse
-import json
 import re
+import io
+
+#the dependency/plugin/parent/repository fields we read
+FIELDS = {'groupId', 'artifactId', 'version', 'type', 'scope', 'url'}
+RECORDS = {'dependency', 'plugin', 'parent', 'repository'}
+PROPERTY = re.compile(r"\$\{([^}]+)\}")
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+#expands ${...} properties (ones that point at other properties too), unknown ones are left alone
+def fix_prop(name, properties):
+    if name is None or '${' not in name:
+        return name
+    for i in range(5):
+        fixed = PROPERTY.sub(lambda m: properties.get(m.group(1), m.group()), name)
+        if fixed == name or '${' not in fixed:
+            return fixed
+        name = fixed
+    return name
+
+#reads a pom in one pass with iterparse, returning its coordinates, properties, parent, and its dependency/plugin/repository records
+def read_pom(xml_file):
+    data = XML_DECLARATION.sub("", xml_file, count=1).encode("utf-8")
+    pom = {'project': {}, 'properties': {}, 'parent': None, 'records': [], 'repositories': []}
+    stack = []
+    records = []
+    for event, elem in ElementTree.iterparse(io.BytesIO(data), events=('start', 'end'), recover=True, remove_comments=True, remove_pis=True):
+        if not isinstance(elem.tag, str):
+            continue
+        #namespaces are dropped, only the local name matters
+        tag = elem.tag.rpartition('}')[2]
+        if event == 'start':
+            stack.append(tag)
+            if tag in RECORDS:
+                records.append({'kind': tag, 'depth': len(stack), 'managed': 'dependencyManagement' in stack or 'pluginManagement' in stack})
+            continue
+        depth = len(stack)
+        text = elem.text.strip() if elem.text else None
+        if records and tag in FIELDS and depth == records[-1]['depth'] + 1:
+            records[-1][tag] = text
+        elif depth == 3 and stack[1] == 'properties':
+            pom['properties'][tag] = text or ""
+        elif depth == 2 and tag in FIELDS:
+            pom['project'][tag] = text
+        if tag in RECORDS:
+            record = records.pop()
+            if tag == 'parent':
+                if depth == 2:
+                    pom['parent'] = record
+            elif tag == 'repository':
+                pom['repositories'].append(record.get('url'))
+            else:
+                pom['records'].append(record)
+        stack.pop()
+        elem.clear()
+    return pom
+
+#the coordinates a pom is published under (its groupId and version can come from its parent)
+def get_coordinates(pom):
+    parent = pom['parent'] or {}
+    project = pom['project']
+    return (project.get('groupId') or parent.get('groupId'), project.get('artifactId'), fix_prop(project.get('version') or parent.get('version'), pom['properties']))
+
+#reads a pom of the repo (once per repo), None if it is broken
+def get_repo_pom(context, path):
+    poms = context.setdefault('poms', {})
+    if path not in poms:
+        try:
+            poms[path] = read_pom(context['files'][path])
+        except Exception:
+            poms[path] = None
+    return poms[path]
+
+#finds a pom in the same repo by its coordinates and resolves it (once per repo), None if the repo doesnt have it
+#seen holds the coordinates of the poms being resolved already, so parents pointing back at a child dont loop
+def find_pom(context, key, seen):
+    if context is None or key in seen:
+        return None
+    with context['lock']:
+        if 'index' not in context:
+            context['index'] = {}
+            for path in sorted(context['files']):
+                pom = get_repo_pom(context, path)
+                if pom is not None:
+                    context['index'].setdefault(get_coordinates(pom), path)
+        path = context['index'].get(key)
+        if path is None:
+            return None
+        resolved = context.setdefault('resolved', {})
+        if path not in resolved:
+            resolved[path] = resolve_pom(get_repo_pom(context, path), context, seen | {key})
+        return resolved[path]
+
+#works out a pom's effective properties and managed versions, from its parent and imported boms in the same repo
+#(context holds the repo's poms, see Scanner.get_repo_context, without one nothing is inherited)
+def resolve_pom(pom, context=None, seen=frozenset()):
+    parent = pom['parent'] or {}
+    project = pom['project']
+    inherited = find_pom(context, (parent.get('groupId'), parent.get('artifactId'), parent.get('version')), seen) if parent else None
+    properties = dict(inherited['properties']) if inherited else {}
+    properties.update(pom['properties'])
+    group = project.get('groupId') or parent.get('groupId')
+    version = project.get('version') or parent.get('version')
+    for prefix in ('project.', 'pom.', ''):
+        properties.update({prefix + 'groupId': group, prefix + 'artifactId': project.get('artifactId'), prefix + 'version': version})
+    properties.update({'project.parent.groupId': parent.get('groupId'), 'project.parent.version': parent.get('version'), 'parent.version': parent.get('version')})
+    properties = {k: v for k, v in properties.items() if v is not None}
+
+    managed = dict(inherited['managed']) if inherited else {}
+    for record in pom['records']:
+        if record['managed'] and record.get('artifactId'):
+            key = (fix_prop(record.get('groupId'), properties), fix_prop(record['artifactId'], properties))
+            record_version = fix_prop(record.get('version'), properties)
+            if record.get('scope') == 'import' and record.get('type') == 'pom':
+                #boms only add versions, they dont override ones given here
+                bom = find_pom(context, (*key, record_version), seen)
+                if bom:
+                    managed = {**bom['managed'], **managed}
+            elif record_version:
+                managed[key] = record_version
+
+    return {'properties': properties, 'managed': managed}
 
 #grabs actual dependencies from an pom file
-def get_maven_dependencies(filename, xml_file):
+def get_maven_dependencies(filename, xml_file, context=None):
     result = []
     try:
-        #the lxml parser hates encoding definitions for whatever reason, remove em
-        xml_file = xml_file.replace("\n", "")
-        xml_file = re.sub(r'encoding=["\'](UTF|utf)\-?8["\']', "", xml_file)
-        xml_file = re.sub("xmlns.*?\s", "", xml_file)
-        parser = ElementTree.XMLParser(recover=True)
-        xmldoc = ElementTree.fromstring(xml_file, parser)
-        
-        #get properties
-        propxml = xmldoc.findall('.//properties')
-        properties = {}
-        if propxml is not None and len(propxml) > 0:
-            for property in propxml[0]:
-                properties[property.tag] = property.text
-        
+        pom = read_pom(xml_file)
+        resolved = resolve_pom(pom, context, frozenset([get_coordinates(pom)]))
+        properties = resolved['properties']
+
         # grab repositories
         external = True
-        repositories = xmldoc.findall('.//repository')
-        if repositories is not None and len(repositories) > 0:
+        if len(pom['repositories']) > 0:
             external = False
-            for repository in repositories:
-                url = repository.find('.//url')
+            for url in pom['repositories']:
                 if url is not None:
-                    domain = urlparse(url.text).netloc
-                    external = external or not any(word in domain for word in dac_constants.INTERNAL_KEYWORDS)
+                    domain = urlparse(fix_prop(url, properties)).netloc
+                    external = external or not dac_constants.INTERNAL_MATCHER.matches(domain)
 
-        #if any repo is external     
+        #if any repo is external
         if external:
             #grab dependencies/plugins
-            deps = xmldoc.findall('.//dependency') + xmldoc.findall('.//plugin')
-            for dep in deps:
-                pkg = dep.find('.//artifactId')
+            for dep in pom['records']:
+                pkg = fix_prop(dep.get('artifactId'), properties)
                 #the name exists... so thats something
-                if pkg is not None:
-                    pkg = fix_prop(pkg.text, properties)
-                gid = dep.find('.//groupId')
-                if gid is not None:
-                    gid = fix_prop(gid.text, properties)
-                version = dep.find('.//version')
-                if version is not None:
-                    version = fix_prop(version.text, properties)
-                    if ',' in version or 'SNAPSHOT' in version:
-                        version = None
+                if pkg is None:
+                    continue
+                gid = fix_prop(dep.get('groupId'), properties)
+                #versions can come from dependencyManagement here, in a parent, or in an imported bom
+                version = fix_prop(dep.get('version') or resolved['managed'].get((gid, pkg)), properties)
+                if version is not None and (',' in version or 'SNAPSHOT' in version):
+                    version = None
                 #if there is a name, a groupid, and a non-snapshot, non-range version, then it isnt vulnerable
                 #otherwise, we add it to be checked
                 if gid is None or version is None:
@@ -71,14 +174,6 @@ def get_maven_dependencies(filename, xml_file):
         raise
     return result
 
-def fix_prop(name, properties):
-    match = re.search(r'\$\{(.*?)\}', name)
-    if match and match.group(1) in properties:
-        name = name.replace(match.group(), properties[match.group(1)])
-    return name
-        
-@sleep_and_retry
-@limits(calls=10, period=1)
 #checks the maven public repo for a package
 def check_maven_public_repo(pkg):
     try:
@@ -86,13 +181,14 @@ def check_maven_public_repo(pkg):
             qs = f"a:%22{pkg['name']}%22%20AND%20g%3A%22{pkg['group']}%22"
         else:
             qs = f"a:%22{pkg['name']}%22"
-        mavenurl = f"https://search.maven.org/solrsearch/select?q={qs}"
-        with urllib.request.urlopen(mavenurl, timeout=10) as url:
-            data = json.loads(url.read().decode())     
-            if data['response']['numFound'] == 0:
-                return '0.0.0.0'
-            else:
-                return data['response']['docs'][0]['latestVersion']
+        mavenurl = f"https://search.maven.org/solrsearch/select?q={qs}&rows=1&wt=json"
+        data = registryclient.get_json(mavenurl, timeout=10)
+        if data['response']['numFound'] == 0:
+            return '0.0.0.0'
+        else:
+            return data['response']['docs'][0]['latestVersion']
     except Exception as e:
         #print(f"Maven Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
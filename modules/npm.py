@@ -8,11 +8,21 @@
 #Checks NPM files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
+import registryclient
 import json
 import re
+import io
 from urllib.parse import urlparse
 
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+DECODER = json.JSONDecoder()
+PNPM_TARBALL = re.compile(r"tarball:\s*'?\"?([^,}'\"\s]+)")
+HOST = re.compile(r"^[a-zA-Z][\w+.-]*://([^/?#]*)")
+INTERNAL_HOSTS = {}
+PNPM_LOCAL = re.compile(r"\b(?:directory|repo):|type:\s*(?:directory|git)")
+#a pnpm v5 packages key (after the leading /): name/version, with an optional _peer suffix (react@17.0.0, @types+react@17.0.0 etc.)
+PNPM_V5_KEY = re.compile(r"^((?:@[^/@]+/)?[^/@]+)/([^/@_]+)(?:_.*)?$")
+
 DEPLIST = ['dependencies', 'devDependencies', 'peerDependencies', 'bundledDependencies', 'bundleDependencies', 'optionalDependencies']
 
 #grabs actual dependencies from an npm json manifest file
@@ -32,43 +42,155 @@ def get_npm_dependencies(filename, json_file):
                         if not dep.startswith('@'):
                             result.append({'name': dep, 'version': version})
         elif filename.lower() == "package-lock.json" or filename.lower() == "npm-shrinkwrap.json":
-            #try to clean it up, get rid of extra }, ], etc
-            data = json.loads(json_file)
-            checklist = []
-            #dependencies come in all these object forms
-            for key in data:
-                if key in DEPLIST:
-                    for dep in data[key]:
-                        version = "TBD"
-                        resolved = None
-                        if 'version' in data[key][dep]:
-                            version = data[key][dep]['version']
-                        if 'resolved' in data[key][dep]:
-                            resolved = data[key][dep]['resolved']
-                            domain = urlparse(resolved).netloc
-                            if any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
-                                continue
-                        if not dep.startswith('@'):
-                            result.append({'name': dep, 'version': version, 'resolved': resolved})    
+            result = get_lock_dependencies(json_file)
+        elif filename.lower() == "pnpm-lock.yaml":
+            result = get_pnpm_dependencies(json_file)
     except Exception as e:
         #print(f"{filename} : NPM Error: {e}")
         raise
     return result
 
+#reads a json document a member at a time, so a huge object (like a lockfile's packages map) is never decoded whole
+#after each key from members(), the caller reads its value with value() or, if it is an object, members() again
+class JSONStream:
+    def __init__(self, text):
+        self.text = text
+        self.idx = 0
+
+    def skip(self, expected=None):
+        self.idx = WHITESPACE.match(self.text, self.idx).end()
+        if expected is not None:
+            if self.text[self.idx:self.idx + 1] != expected:
+                raise ValueError(f"expected {expected} at {self.idx}")
+            self.idx = WHITESPACE.match(self.text, self.idx + 1).end()
+
+    #yields the keys of the object at the current position
+    def members(self):
+        self.skip('{')
+        if self.text[self.idx:self.idx + 1] == '}':
+            self.idx += 1
+            return
+        while True:
+            key, self.idx = DECODER.raw_decode(self.text, self.idx)
+            self.skip(':')
+            yield key
+            self.skip()
+            if self.text[self.idx:self.idx + 1] == '}':
+                self.idx += 1
+                return
+            self.skip(',')
+
+    #decodes the value at the current position
+    def value(self):
+        self.skip()
+        value, self.idx = DECODER.raw_decode(self.text, self.idx)
+        return value
+
+#checks if a resolved url is on an internal registry (lockfiles resolve thousands of packages from a handful of hosts, so hosts are only matched once)
+def is_internal(resolved):
+    match = HOST.match(resolved)
+    host = match.group(1) if match else urlparse(resolved).netloc
+    internal = INTERNAL_HOSTS.get(host)
+    if internal is None:
+        internal = INTERNAL_HOSTS[host] = dac_constants.INTERNAL_MATCHER.matches(host)
+    return internal
+
+#adds a locked package (once per name), unless it came from an internal registry
+def add_locked(result, seen, name, version, resolved):
+    if not name or name.startswith('@') or name in seen:
+        return
+    if resolved and is_internal(resolved):
+        return
+    seen.add(name)
+    result.append({'name': name, 'version': version or "TBD", 'resolved': resolved})
+
+#grabs dependencies from a package-lock.json/npm-shrinkwrap.json
+#v2/v3 lockfiles list every installed package in a flat packages map (keyed by node_modules path), which is streamed an entry at a time,
+#v1 ones only have the nested dependencies tree
+def get_lock_dependencies(json_file):
+    result = []
+    seen = set()
+    stream = JSONStream(json_file)
+    packages = False
+    for key in stream.members():
+        if key == 'packages':
+            packages = True
+            for path in stream.members():
+                package = stream.value()
+                #the root project and workspace folders arent installed from anywhere
+                if 'node_modules/' not in path or package.get('link'):
+                    continue
+                #aliased packages give their real name
+                name = package.get('name') or path.rsplit('node_modules/', 1)[1]
+                add_locked(result, seen, name, package.get('version'), package.get('resolved'))
+        elif packages:
+            #v2 also has the v1 dependencies tree, but its just a copy of packages
+            break
+        elif key in DEPLIST:
+            dependencies = stream.value()
+            for dep in dependencies:
+                add_locked(result, seen, dep, dependencies[dep].get('version'), dependencies[dep].get('resolved'))
+        else:
+            stream.value()
+    return result
+
+#grabs dependencies from a pnpm-lock.yaml, a line at a time
+#the packages section is keyed /name/1.0.0 (v5), /name@1.0.0 (v6) or name@1.0.0 (v9), maybe with peer suffixes (_peer or (peer@1.0.0))
+def get_pnpm_dependencies(contents):
+    result = []
+    seen = set()
+    section = None
+    package = None
+    for line in io.StringIO(contents):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        if indent == 0:
+            section = line.strip().rstrip(':')
+        elif section != 'packages':
+            continue
+        elif indent == 2:
+            if package:
+                add_locked(result, seen, *package)
+            package = get_pnpm_package(line.strip().rstrip(':'))
+        elif package:
+            tarball = PNPM_TARBALL.search(line)
+            if tarball:
+                package[2] = tarball.group(1)
+            elif PNPM_LOCAL.search(line):
+                #directories and git repos arent from a registry
+                package = None
+    if package:
+        add_locked(result, seen, *package)
+    return result
+
+#gets [name, version, resolved] from a pnpm packages key, or None if it isnt a registry package
+def get_pnpm_package(key):
+    key = key.strip("'\"")
+    registry = key.startswith('/')
+    key = key.lstrip('/').split('(')[0]
+    #v5 keys first, their peer suffixes have @s in them too
+    v5 = PNPM_V5_KEY.match(key) if registry else None
+    if v5:
+        name, version = v5.groups()
+    elif '@' in key[1:]:
+        name, version = key.rsplit('@', 1)
+    else:
+        return None
+    if ':' in version or '/' in version:
+        #git, file, link etc.
+        return None
+    return [name, version, None]
+
 #checks the npm public repo for a package
 def check_npm_public_repo(pkg):
     try:
-        if 'resolved' in pkg:
-            return pkg['version']
-        with urllib.request.urlopen(f"https://registry.npmjs.org/{pkg['name']}/", timeout=10) as url:
-            data = json.loads(url.read().decode())
-        if "dist-tags" in data:
-            return data['dist-tags']['latest']
-        else:
-            return data['time']['unpublished']['versions'][0]
+        return registryclient.get_npm_latest("https://registry.npmjs.org", pkg['name'], timeout=10)
     except Exception as e:
         #print(f"NPM Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
 
 def check_npm_config(config):
     try:
@@ -77,7 +199,7 @@ def check_npm_config(config):
         if len(matches) == 0:
             return False
         for match in matches:
-            if not any(x in match for x in dac_constants.INTERNAL_KEYWORDS):
+            if not dac_constants.INTERNAL_MATCHER.matches(match):
                 return False
         return True
     except Exception as e:
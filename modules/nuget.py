@@ -31,7 +31,7 @@ def parse_nuget_config(filename, contents):
                     clear = True
                 elif element.tag == "add":
                     domain = urlparse(element.get('value')).netloc
-                    if not any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
+                    if not dac_constants.INTERNAL_MATCHER.matches(domain):
                         external = True
         if clear and not external:
             #safe
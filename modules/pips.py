@@ -12,7 +12,7 @@ import dac_constants
 import toml
 import re
 import json
-from pypi_simple import PyPISimple
+import registryclient
 from urllib.parse import urlparse
 
 def get_pip_dependencies(filename, req_file):
@@ -61,7 +61,7 @@ def get_pip_dependencies(filename, req_file):
                 external = False
                 for server in servers:
                     domain = urlparse(server).netloc
-                    if not any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
+                    if not dac_constants.INTERNAL_MATCHER.matches(domain):
                         external = True
             if not external:
                 return result
@@ -82,13 +82,16 @@ def get_pip_dependencies(filename, req_file):
 #checks the pip public repo for a package
 def check_pip_public_repo(pkg):
     try:
-        with PyPISimple() as client:
-            version = 0
-            requests_page = client.get_project_page(pkg['name'])
-            if requests_page:
-                return requests_page.repository_version
-            else:
-                return '0.0.0.0'
+        #a HEAD on the simple index page is enough to know the project exists (PEP 503 names)
+        name = re.sub(r"[-_.]+", "-", pkg['name']).lower()
+        status = registryclient.head(f"https://pypi.org/simple/{name}/", timeout=10)
+        if status == 200:
+            return "TBD"
+        elif status in registryclient.NOT_FOUND_CODES:
+            return '0.0.0.0'
+        raise Exception(f"pypi returned {status} for {name}")
     except Exception as e:
         #print(f"PiP Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
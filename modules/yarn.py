@@ -8,44 +8,82 @@
 #Checks YARN files for potential and active dependency confusion attacks
 ###
 import dac_constants
-import urllib
+import registryclient
 import re
 import json
 import collections
+import io
+import yaml
 from pyarn import lockfile
 from urllib.parse import urlparse
 
-#grabs actual dependencies from a yarn file
+#first package name in a yarn.lock entry (v1: "name@^1.0.0", name@^1.1.0:  berry: "name@npm:^1.0.0, name@npm:^1.1.0":)
+ENTRY = re.compile(r'^"?((?:@[^@/"]+/)?[^@"\s]+)@')
+#version/resolved (v1, 'key "value"') and version/resolution (berry, 'key: value') fields of an entry
+FIELD = re.compile(r'^\s+(version|resolved|resolution):?\s+"?([^"\n]*?)"?\s*$')
+
+#grabs actual dependencies from a yarn.lock, a line at a time (v1 or berry, each name once)
 def get_yarn_dependencies(filename, contents):
     packages = []
     try:
-        pat = re.compile(r'^\n(.*?):\n\s*version\s*"(.*?)"\n\s*resolved\s*"(.*?)"', re.MULTILINE)
-        matches = re.finditer(pat, contents)
-        for match in matches:
-            resolved = match.group(3)
-            domain = urlparse(resolved).netloc
-            if any(word in domain for word in dac_constants.INTERNAL_KEYWORDS):
-                continue            
-            name = match.group(1).replace('"', '').split(', ')[0].rsplit('@', 1)[0].strip()
-            if not name.startswith('@'):
-                packages.append({'name': name, 'version': match.group(2), 'resolved': resolved})
+        seen = set()
+        entry = None
+        for line in io.StringIO(contents):
+            if not line.strip() or line.startswith('#'):
+                continue
+            if not line[0].isspace():
+                add_yarn_package(packages, seen, entry)
+                match = ENTRY.match(line)
+                entry = {'name': match.group(1)} if match else None
+            elif entry is not None:
+                field = FIELD.match(line)
+                if field:
+                    entry[field.group(1)] = field.group(2)
+        add_yarn_package(packages, seen, entry)
 
     except Exception as e:
         #print(f"YARN Error: {e}")
         raise
     return packages
 
+#adds a yarn.lock entry, if it came from a public registry
+def add_yarn_package(packages, seen, entry):
+    if entry is None or 'version' not in entry:
+        return
+    if 'resolution' in entry:
+        #berry: only npm: resolutions come from a registry (not workspace:, patch:, link: etc.), which one is set in .yarnrc.yml
+        if '@npm:' not in entry['resolution']:
+            return
+        name = entry['resolution'].rsplit('@npm:', 1)[0]
+        resolved = entry['resolution']
+    elif 'resolved' in entry:
+        name = entry['name']
+        resolved = entry['resolved']
+        domain = urlparse(resolved).netloc
+        if dac_constants.INTERNAL_MATCHER.matches(domain):
+            return
+    else:
+        return
+    if not name.startswith('@') and name not in seen:
+        seen.add(name)
+        packages.append({'name': name, 'version': entry['version'], 'resolved': resolved})
+
+#checks a .yarnrc.yml (yarn berry) to see if packages come from an internal registry
+def check_yarn_config(config):
+    try:
+        data = yaml.safe_load(config['content']) or {}
+        registry = data.get('npmRegistryServer')
+        return bool(registry) and dac_constants.INTERNAL_MATCHER.matches(registry)
+    except Exception as e:
+        print(f"YARN Error: {e}")
+        return False
+
 #checks the npm public repo for a package
 def check_yarn_public_repo(pkg):
     try:
-        if 'resolved' in pkg:
-            return pkg['version']        
-        with urllib.request.urlopen(f"https://registry.yarnpkg.com/{pkg['name']}", timeout=5) as url:
-            data = json.loads(url.read().decode())
-        if "dist-tags" in data:
-            return data['dist-tags']['latest']
-        else:
-            return data['time']['unpublished']['versions'][0]
+        return registryclient.get_npm_latest("https://registry.yarnpkg.com", pkg['name'], timeout=5)
     except Exception as e:
         #print(f"YARN Error: {e}")
-        return '0.0.0.0'
+        if registryclient.not_found(e):
+            return '0.0.0.0'
+        raise
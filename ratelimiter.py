@@ -0,0 +1,159 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import time
+import multiprocessing
+from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+import dac_constants
+
+#slots in the shared state array (the first three are the bucket itself, the rest belong to the limiter using it)
+TOKENS, LAST, PAUSE = range(3)
+REMAINING, RESET, KNOWN = range(3, 6)
+RATE, MAX_RATE, CUT = range(3, 6)
+
+#token bucket kept in shared memory, so child processes given the same limiter all pace against one bucket
+#subclasses say how fast it refills (get_rate) and how responses change that (update)
+class TokenBucket(ABC):
+
+    def __init__(self, burst):
+        self.burst = burst
+        self.state = multiprocessing.Array('d', 6)
+        self.state[TOKENS] = burst
+        self.state[LAST] = time.time()
+
+    #tokens per second to refill at (None for no limit right now)
+    #must be called with the lock held
+    @abstractmethod
+    def get_rate(self, now):
+        pass
+
+    #blocks until a request can be made
+    def acquire(self):
+        while True:
+            with self.state.get_lock():
+                now = time.time()
+                rate = None if now < self.state[PAUSE] else self.get_rate(now)
+                if now < self.state[PAUSE]:
+                    wait = self.state[PAUSE] - now
+                elif rate is None:
+                    return
+                elif rate == 0:
+                    #get_rate paused us
+                    wait = max(self.state[PAUSE] - now, 1)
+                else:
+                    self.state[TOKENS] = min(self.burst, self.state[TOKENS] + (now - self.state[LAST]) * rate)
+                    self.state[LAST] = now
+                    if self.state[TOKENS] >= 1:
+                        self.state[TOKENS] -= 1
+                        return
+                    wait = (1 - self.state[TOKENS]) / rate
+            time.sleep(wait)
+
+    #pauses everyone for seconds (only the first thread to hit a limit says so), returns the wait
+    #must be called with the lock held
+    def pause(self, seconds, reason):
+        until = time.time() + seconds
+        if until > self.state[PAUSE] + 1:
+            print(f"{self.name} RATE LIMIT HIT ({reason}), SLEEPING FOR: {seconds:.1f} seconds")
+            self.state[PAUSE] = until
+        return max(self.state[PAUSE] - time.time(), 0)
+
+    #reads a response, returns True if the request was throttled (and should be retried)
+    @abstractmethod
+    def update(self, response):
+        pass
+
+#limiter for the GitHub API, shared by every thread in every process of a scan
+#the refill rate comes from the X-RateLimit-Remaining/X-RateLimit-Reset headers on normal responses (no extra calls),
+#so the calls we have left are spread out until the reset instead of being burnt through and then waited out
+class GitHubLimiter(TokenBucket):
+
+    def __init__(self, burst=None, reserve=None):
+        super().__init__(dac_constants.GITHUB_BURST if burst is None else burst)
+        self.name = "GIT API"
+        self.reserve = dac_constants.GITHUB_RATE_RESERVE if reserve is None else reserve
+
+    #calls we can spend per second without running out before the reset (None if the server hasnt told us a limit)
+    def get_rate(self, now):
+        if not self.state[KNOWN]:
+            return None
+        if now >= self.state[RESET]:
+            #the window has reset, so what we know is stale, calls go through until a response tells us the new limit
+            self.state[KNOWN] = 0
+            return None
+        rate = max(self.state[REMAINING] - self.reserve, 0) / max(self.state[RESET] - now, 1)
+        if rate == 0:
+            #out of calls, wait for the reset
+            self.pause(self.state[RESET] - now + 1, "rate limit reserve reached")
+        return rate
+
+    def update(self, response):
+        headers = response.headers
+        with self.state.get_lock():
+            #graphql (and search) calls have their own budgets, the bucket paces the core rest one
+            if 'X-RateLimit-Remaining' in headers and 'X-RateLimit-Reset' in headers and headers.get('X-RateLimit-Resource', 'core') == 'core':
+                self.state[REMAINING] = int(headers['X-RateLimit-Remaining'])
+                self.state[RESET] = int(headers['X-RateLimit-Reset'])
+                self.state[KNOWN] = 1
+            if response.status_code not in (403, 429):
+                return False
+            #secondary (abuse) limits send Retry-After, primary ones run remaining down to 0
+            if 'Retry-After' in headers:
+                self.pause(int(headers['Retry-After']), "retry-after")
+            elif headers.get('X-RateLimit-Remaining') == '0':
+                self.pause(int(headers.get('X-RateLimit-Reset', self.state[RESET])) - time.time() + 1, "no calls remaining")
+            elif 'rate limit' in response.text.lower():
+                self.pause(dac_constants.GITHUB_SECONDARY_WAIT, "secondary rate limit")
+            else:
+                #a plain permissions 403
+                return False
+            return True
+
+#limiter for a public registry host, with an AIMD rate: it creeps back up to the host's budget while calls succeed,
+#and is cut (and everyone paused for Retry-After, if given) whenever the registry answers 429/503
+class RegistryLimiter(TokenBucket):
+
+    def __init__(self, host, budget):
+        super().__init__(max(budget, 1))
+        self.name = host
+        self.state[RATE] = budget
+        self.state[MAX_RATE] = budget
+
+    def get_rate(self, now):
+        return self.state[RATE]
+
+    def update(self, response):
+        aimd = dac_constants.REGISTRY_AIMD
+        with self.state.get_lock():
+            if response.status_code not in (429, 503):
+                self.state[RATE] = min(self.state[MAX_RATE], self.state[RATE] + aimd['increase'])
+                return False
+            #a burst of throttled calls in flight together only counts as one cut
+            if time.time() - self.state[CUT] > 1:
+                self.state[RATE] = max(aimd['min_rate'], self.state[RATE] * aimd['decrease'])
+                self.state[CUT] = time.time()
+            retry = response.headers.get('Retry-After', "")
+            self.pause(int(retry) if retry.isdigit() else 1 / self.state[RATE], f"{response.status_code}, rate now {self.state[RATE]:.1f}/s")
+            return True
+
+#transport adapter that paces every request through a limiter and retries throttled ones once the limit clears
+class RateLimitedAdapter(HTTPAdapter):
+
+    def __init__(self, limiter, retries=None, **kwargs):
+        self.limiter = limiter
+        self.retries = dac_constants.GITHUB_RETRIES if retries is None else retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            response = super().send(request, **kwargs)
+            if not self.limiter.update(response) or attempt >= self.retries:
+                return response
+            response.close()
+            attempt += 1
@@ -0,0 +1,120 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import re
+import json
+import threading
+import requests
+from urllib.parse import urlparse
+from ratelimiter import RegistryLimiter, RateLimitedAdapter
+import dac_constants
+
+#abbreviated (install) metadata, much smaller than the full packument
+NPM_ABBREVIATED = {'Accept': 'application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8'}
+NPM_DIST_TAGS = re.compile(rb'"dist-tags"\s*:\s*(\{[^{}]*\})')
+
+#one pooled keep-alive session per registry host (per process, sockets dont survive a fork)
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+#one limiter per registry host, shared with worker processes (see get_limiters/set_limiters)
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+#gets (or creates) the limiter for a registry host
+def get_limiter(host):
+    limiter = LIMITERS.get(host)
+    if limiter is None:
+        with LIMITERS_LOCK:
+            limiter = LIMITERS.get(host)
+            if limiter is None:
+                limiter = RegistryLimiter(host, dac_constants.REGISTRY_LIMITS.get(host, dac_constants.REGISTRY_LIMITS['default']))
+                LIMITERS[host] = limiter
+    return limiter
+
+#gets the limiters for every configured host, to hand to worker processes so they all share one budget per host
+def get_limiters():
+    for host in dac_constants.REGISTRY_LIMITS:
+        if host != 'default':
+            get_limiter(host)
+    return LIMITERS
+
+#uses limiters from a parent process (call before any requests are made)
+def set_limiters(limiters):
+    with LIMITERS_LOCK:
+        LIMITERS.update(limiters)
+
+#gets (or creates) the shared session for the host in url
+def get_session(url):
+    host = urlparse(url).netloc
+    key = (os.getpid(), host)
+    session = SESSIONS.get(key)
+    if session is None:
+        with SESSIONS_LOCK:
+            session = SESSIONS.get(key)
+            if session is None:
+                size = dac_constants.REGISTRY_CONNECTIONS.get(host, dac_constants.REGISTRY_CONNECTIONS['default'])
+                #pool_block caps the number of concurrent requests to this host at the pool size,
+                #and the limiter caps how many go out per second (throttled calls are retried once it clears)
+                adapter = RateLimitedAdapter(get_limiter(host), dac_constants.REGISTRY_RETRIES, pool_connections=1, pool_maxsize=size, pool_block=True)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                SESSIONS[key] = session
+    return session
+
+#statuses that mean a package really isnt there
+NOT_FOUND_CODES = (404, 410)
+
+#returns True if a lookup failed because the package doesnt exist (rather than a timeout, 5xx, etc)
+#only these become '0.0.0.0', anything else has to be raised so it isnt reported (or cached) as vulnerable
+def not_found(e):
+    response = getattr(e, 'response', None)
+    return response is not None and response.status_code in NOT_FOUND_CODES
+
+#GETs a url through the pooled session for its host, raising on http errors
+def get(url, timeout=10, **kwargs):
+    res = get_session(url).get(url, timeout=timeout, **kwargs)
+    res.raise_for_status()
+    return res
+
+#GETs a url and returns the decoded json
+def get_json(url, timeout=10, **kwargs):
+    return get(url, timeout, **kwargs).json()
+
+#POSTs data to a url and returns the decoded json
+def post_json(url, data, timeout=10, **kwargs):
+    res = get_session(url).post(url, data, timeout=timeout, **kwargs)
+    res.raise_for_status()
+    return res.json()
+
+#HEADs a url and returns the status code (for cheap existence checks)
+def head(url, timeout=10, **kwargs):
+    return get_session(url).head(url, timeout=timeout, **kwargs).status_code
+
+#streams a url until pattern matches, returns the match (or None if the whole body was read without one)
+#this stops the download early so we dont pull down (and parse) megabytes of json to read one field
+#only each new chunk and the last overlap bytes before it are searched, so a match can be up to overlap bytes long
+def search_stream(url, pattern, timeout=10, chunk_size=16384, overlap=4096, **kwargs):
+    with get_session(url).get(url, timeout=timeout, stream=True, **kwargs) as res:
+        res.raise_for_status()
+        data = b""
+        for chunk in res.iter_content(chunk_size):
+            data = data[-overlap:] + chunk
+            match = pattern.search(data)
+            if match:
+                return match
+    return None
+
+#gets the latest version of a package from an npm style registry
+def get_npm_latest(registry, name, timeout=10):
+    match = search_stream(f"{registry}/{name}", NPM_DIST_TAGS, timeout, headers=NPM_ABBREVIATED)
+    if match:
+        return json.loads(match.group(1))['latest']
+    #unpublished packages dont have dist-tags, they only show up in the full document
+    data = get_json(f"{registry}/{name}/", timeout)
+    return data['time']['unpublished']['versions'][0]
@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import time
+import threading
+import concurrent.futures
+import dac_constants
+import snapshot
+from lookupcache import LookupCache, MemoryCache, ERROR
+
+#central registry resolution stage, every manifest in the process pushes its dependencies through here
+#each registry gets a fixed pool of workers, and a name that is already being looked up is only looked up once
+class Resolver:
+
+    def __init__(self, workers=None):
+        self.workers = dac_constants.RESOLVER_WORKERS if workers is None else workers
+        self.memory = MemoryCache()
+        self.lookupcache = LookupCache()
+        self.pools = {}
+        self.inflight = {}
+        #reentrant, since a future that is already done runs its callback (and takes the lock) straight away
+        self.lock = threading.RLock()
+
+    #gets (or creates) the worker pool for a registry
+    def get_pool(self, registry):
+        pool = self.pools.get(registry)
+        if pool is None:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers.get(registry, self.workers['default']), thread_name_prefix=f"resolve-{registry}")
+            self.pools[registry] = pool
+        return pool
+
+    #queues a package for resolution, returns a future for its public version
+    #callers asking for the same package while it is in flight share one future
+    #a package carrying its module's locked field (e.g. a lockfile's resolved url) already says where it came from, so its
+    #own version is the answer, and since it isnt a registry answer it never goes near the caches or the in flight table
+    def submit(self, repo_check_method, pkg, registry=None, cache_key=('name',), locked_field=None):
+        if locked_field is not None and locked_field in pkg:
+            fut = concurrent.futures.Future()
+            fut.set_result(pkg['version'])
+            return fut
+        coords = LookupCache.get_coords(pkg, cache_key)
+        key = (registry or repo_check_method.__qualname__, coords)
+        version = self.memory.get(key)
+        if version is not None:
+            fut = concurrent.futures.Future()
+            fut.set_result(version)
+            return fut
+        with self.lock:
+            fut = self.inflight.get(key)
+            if fut is None:
+                fut = self.get_pool(key[0]).submit(self.resolve, repo_check_method, pkg, registry, coords, key)
+                self.inflight[key] = fut
+                fut.add_done_callback(lambda f: self.done(key))
+        return fut
+
+    #drops a finished lookup from the in flight table
+    def done(self, key):
+        with self.lock:
+            self.inflight.pop(key, None)
+
+    #does the actual lookup (offline snapshot first, then the disk cache, then the registry) on a worker thread
+    def resolve(self, repo_check_method, pkg, registry, coords, key):
+        version = None
+        if registry is not None:
+            #names in the snapshot exist, anything missing from it gets confirmed live
+            index = snapshot.get_index(registry)
+            if index is not None and index.contains(coords):
+                version = "TBD"
+        if registry is not None and version is None:
+            version = self.lookupcache.get(registry, coords)
+        if version is None:
+            version = self.check(repo_check_method, pkg)
+            #failed lookups arent cached anywhere, so the retry pass (or the next run) asks again
+            if version == ERROR:
+                return version
+            if registry is not None:
+                self.lookupcache.put(registry, coords, version)
+        self.memory.put(key, version)
+        return version
+
+    #asks the registry, backing off and retrying when the lookup fails (rather than when the package isnt there)
+    @staticmethod
+    def check(repo_check_method, pkg):
+        error = None
+        for attempt in range(dac_constants.RESOLVER_RETRIES + 1):
+            try:
+                return repo_check_method(pkg)
+            except Exception as e:
+                error = e
+                if attempt < dac_constants.RESOLVER_RETRIES:
+                    time.sleep(dac_constants.RESOLVER_BACKOFF * 2 ** attempt)
+        print(f"Error: {error} in {repo_check_method.__name__}({pkg['name']})")
+        return ERROR
+
+    #resolves a list of packages, returns {'package', 'version'} results in the same order
+    def resolve_all(self, repo_check_method, pkgs, registry=None, cache_key=('name',), locked_field=None):
+        futs = [self.submit(repo_check_method, pkg, registry, cache_key, locked_field) for pkg in pkgs]
+        return [{'package': pkg, 'version': fut.result()} for pkg, fut in zip(pkgs, futs)]
+
+    #stops the worker pools
+    def shutdown(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False)
+            self.pools = {}
@@ -0,0 +1,40 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import json
+import threading
+
+#streams results to disk as NDJSON (one record per repo/project) as they finish
+#recap totals are kept as a running aggregate, so nothing but the totals stays in memory
+class ResultsWriter:
+
+    def __init__(self, resultsfile, count_func):
+        self.resultsfile = resultsfile
+        #count_func(record) returns (vulnerable, sus) for a single record
+        self.count_func = count_func
+        self.lock = threading.Lock()
+        self.totals = {'scanned': 0, 'vulnerable': 0, 'sus': 0}
+        self.file = open(resultsfile, "w")
+
+    #writes a single record and adds it to the totals
+    def write(self, record):
+        line = json.dumps(record)
+        v, s = self.count_func(record)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.totals['scanned'] += 1
+            self.totals['vulnerable'] += v
+            self.totals['sus'] += s
+
+    #writes the recap as the last record and closes the file
+    def close(self, recap, print_name=True):
+        with self.lock:
+            self.file.write(json.dumps({'recap': recap}) + "\n")
+            self.file.close()
+        if print_name:
+            print(os.path.realpath(self.resultsfile))
@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import time
+import json
+import sqlite3
+import threading
+import dac_constants
+
+#what each repo looked like the last time it was scanned (for incremental scans)
+#repos are keyed by their default branch HEAD sha, and each of their manifests by its blob sha
+#so unchanged repos/manifests can reuse their previous result instead of being fetched and scanned again
+class ScanState:
+
+    def __init__(self, path=None, max_age=None):
+        self.path = dac_constants.STATE_FILE if path is None else path
+        self.max_age = dac_constants.STATE_MAX_AGE if max_age is None else max_age
+        self.local = threading.local()
+
+    #sqlite connections cant be shared across threads or forks, so each thread in each process gets its own
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS repos (repo TEXT PRIMARY KEY, head TEXT NOT NULL, result TEXT NOT NULL, checked REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS manifests (repo TEXT NOT NULL, path TEXT NOT NULL, sha TEXT NOT NULL, override INTEGER NOT NULL, result TEXT NOT NULL, checked REAL NOT NULL, PRIMARY KEY (repo, path))")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    #returns the previous result for a repo if its HEAD hasnt moved (and the result isnt too old), otherwise None
+    def get_repo(self, repo, head):
+        try:
+            row = self.get_connection().execute("SELECT head, result, checked FROM repos WHERE repo = ?", (repo,)).fetchone()
+            if row is None or row[0] != head or time.time() - row[2] > self.max_age:
+                return None
+            return json.loads(row[1])
+        except Exception as e:
+            print(f"Error: {e} in ScanState.get_repo")
+            return None
+
+    #returns the previous (still fresh) manifest results for a repo, as path: {'sha', 'override', 'result', 'checked'}
+    def get_manifests(self, repo):
+        try:
+            rows = self.get_connection().execute("SELECT path, sha, override, result, checked FROM manifests WHERE repo = ? AND checked >= ?", (repo, time.time() - self.max_age)).fetchall()
+            return {r[0]: {'sha': r[1], 'override': bool(r[2]), 'result': json.loads(r[3]), 'checked': r[4]} for r in rows}
+        except Exception as e:
+            print(f"Error: {e} in ScanState.get_manifests")
+            return {}
+
+    #returns the previous result for a manifest if its blob (and override) is unchanged, otherwise None
+    @staticmethod
+    def get_manifest(manifests, path, sha, override):
+        row = manifests.get(path)
+        if row is None or row['sha'] != sha or row['override'] != bool(override):
+            return None
+        return row
+
+    #stores a repo's result along with all of its manifests (replacing whatever was there, so removed manifests drop out)
+    #result is the list of manifest results, manifests the clean ones among them as {'path', 'sha', 'override', 'result', 'checked'}
+    #(checked is only set for reused results, so they still age out)
+    def put_repo(self, repo, head, result, manifests):
+        #a repo with failed lookups cant be reused as a whole (its HEAD isnt kept), only its clean manifests can
+        if len(manifests) != len(result):
+            head = ""
+        now = time.time()
+        try:
+            conn = self.get_connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM manifests WHERE repo = ?", (repo,))
+                conn.executemany("INSERT INTO manifests (repo, path, sha, override, result, checked) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(repo, m['path'], m['sha'], int(bool(m['override'])), json.dumps(m['result']), m.get('checked') or now) for m in manifests])
+                #the repo result is only as fresh as the oldest manifest in it
+                checked = min([now] + [m['checked'] for m in manifests if m.get('checked')])
+                conn.execute("INSERT OR REPLACE INTO repos (repo, head, result, checked) VALUES (?, ?, ?, ?)", (repo, head, json.dumps(result), checked))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            print(f"Error: {e} in ScanState.put_repo")
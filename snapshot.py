@@ -0,0 +1,128 @@
+#
+# Copyright (c) 2021, salesforce.com, inc.
+# All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import re
+import json
+import mmap
+import time
+import threading
+import registryclient
+import dac_constants
+
+#where to pull the full list of package names from for each registry
+#maven central has no name list, so maven snapshots need a -source file of group:artifactId lines
+SOURCES = {
+    'npm': 'https://replicate.npmjs.com/_all_docs',
+    'pypi': 'https://pypi.org/simple/',
+    'rubygems': 'https://rubygems.org/names',
+    'packagist': 'https://packagist.org/packages/list.json',
+    'cocoapods': 'https://cdn.cocoapods.org/all_pods.txt',
+    'maven': None
+}
+
+NPM_ROW = re.compile(r'^\{"id":"(.*?)"')
+PYPI_ROW = re.compile(r'<a [^>]*>([^<]+)</a>')
+
+#loaded indexes, per registry (None if there isnt a usable snapshot)
+INDEXES = {}
+INDEXES_LOCK = threading.Lock()
+
+#puts a name in the form it is stored in the index
+def normalize(registry, name):
+    if registry == 'pypi':
+        return re.sub(r"[-_.]+", "-", name).lower()
+    if registry in ('packagist', 'cocoapods'):
+        return name.lower()
+    return name
+
+#gets the index file for a registry
+def get_path(registry):
+    return os.path.join(dac_constants.SNAPSHOT_DIR, f"{registry}.idx")
+
+#yields the package names from a source (a url or a local file)
+def read_names(registry, source):
+    if os.path.isfile(source):
+        with open(source, encoding="utf-8") as f:
+            lines = [x.strip() for x in f]
+    else:
+        res = registryclient.get(source, timeout=600, stream=True)
+        if registry == 'packagist':
+            lines = json.loads(res.content)['packageNames']
+        else:
+            lines = (x.decode("utf-8", "replace").strip() for x in res.iter_lines())
+    for line in lines:
+        if registry == 'npm' and line.startswith('{'):
+            match = NPM_ROW.search(line)
+            line = match.group(1) if match else ""
+        elif registry == 'pypi' and line.startswith('<'):
+            match = PYPI_ROW.search(line)
+            line = match.group(1) if match else ""
+        if line and not line.startswith('#') and not line.startswith('<'):
+            yield line
+
+#builds the sorted name file for a registry, returns the number of names in it
+def build(registry, source=None):
+    source = source or SOURCES[registry]
+    if not source:
+        raise ValueError(f"{registry} has no public name list, use -source with a file of names")
+    names = sorted(set(normalize(registry, x).encode("utf-8") for x in read_names(registry, source)))
+    os.makedirs(dac_constants.SNAPSHOT_DIR, exist_ok=True)
+    path = get_path(registry)
+    #write to a temp file and swap it in, so running scans never see half an index
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\n".join(names))
+    os.replace(path + ".tmp", path)
+    return len(names)
+
+#sorted, newline separated list of names, searched in place with mmap
+class SnapshotIndex:
+
+    def __init__(self, registry, path):
+        self.registry = registry
+        self.path = path
+        self.built = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    #binary search for a name
+    def contains(self, name):
+        key = normalize(self.registry, name).encode("utf-8")
+        lo = 0
+        hi = len(self.mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.mm.rfind(b"\n", 0, mid) + 1
+            end = self.mm.find(b"\n", start)
+            if end == -1:
+                end = len(self.mm)
+            line = self.mm[start:end]
+            if line == key:
+                return True
+            if line < key:
+                lo = end + 1
+            else:
+                hi = start
+        return False
+
+#gets the index for a registry, or None if there isnt one (or it is too old to trust)
+def get_index(registry):
+    if registry in INDEXES:
+        return INDEXES[registry]
+    with INDEXES_LOCK:
+        if registry not in INDEXES:
+            index = None
+            path = get_path(registry)
+            try:
+                if os.path.isfile(path) and os.path.getsize(path) > 0:
+                    if time.time() - os.path.getmtime(path) > dac_constants.SNAPSHOT_MAX_AGE:
+                        print(f"Ignoring stale {registry} snapshot ({path})")
+                    else:
+                        index = SnapshotIndex(registry, path)
+            except Exception as e:
+                print(f"Error: {e} in get_index({registry})")
+            INDEXES[registry] = index
+    return INDEXES[registry]